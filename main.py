@@ -1,7 +1,29 @@
 import chess
 import chess.engine
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APIError, APIStatusError, RateLimitError
 import os
+import time
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import datetime
+import email.utils
+import functools
+import hashlib
+import httpx
+import itertools
+import json
+import math
+import random
+import re
+import multiprocessing
+import multiprocessing.util
+import socket
+import sqlite3
+import threading
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
 from dotenv import load_dotenv
 
 
@@ -9,102 +31,2521 @@ load_dotenv()  # load environment variables from .env
 api_key = os.getenv("OPENAI_API_KEY")
 print("API key:", api_key)
 client = OpenAI(api_key=api_key)
+async_client = AsyncOpenAI(api_key=api_key)  # used by the asyncio game loop
 
 # Set Stockfish engine path 
-STOCKFISH_PATH = "/opt/homebrew/bin/stockfish"
+STOCKFISH_PATH = os.getenv("STOCKFISH_PATH", "/opt/homebrew/bin/stockfish")
+WHITE_LIMIT = chess.engine.Limit(time=2.0)  # Stockfish's search per move as White
 
-try:
-    engine = chess.engine.SimpleEngine.popen_uci(STOCKFISH_PATH)
-except Exception as e:
-    print(f"Error starting Stockfish: {e}")
-    engine = None  # Engine is optional
+# Started by start_engine() from __main__, not at import: spawned worker
+# processes import this module too, and an engine started there would keep
+# them alive after the pool shuts down (its I/O thread is not a daemon).
+engine = None
 
-def get_ai_move(board: chess.Board) -> str:
+def start_engine():
+    global engine
+    try:
+        engine = chess.engine.SimpleEngine.popen_uci(STOCKFISH_PATH)
+    except Exception as e:
+        print(f"Error starting Stockfish: {e}")
+        engine = None  # Engine is optional
+
+def restart_engine():
+    # Replace a crashed engine so one Stockfish failure does not end the run.
+    global engine
+    if engine:
+        try:
+            engine.close()
+        except Exception:
+            pass
+    try:
+        engine = chess.engine.SimpleEngine.popen_uci(STOCKFISH_PATH)
+    except Exception as e:
+        print(f"Error restarting Stockfish: {e}")
+        engine = None
+    if engine and cassette and cassette.mode == "record":
+        engine = RecordingEngine(engine, cassette)
+
+def _quit_engine():
+    if engine:
+        try:
+            engine.quit()
+        except Exception as e:
+            print(f"Error stopping Stockfish: {e}")
+
+class EnginePool:
+    # A fixed set of Stockfish processes (asyncio protocol API) shared by all
+    # games running on one event loop. Games lease an engine for the whole
+    # game or for a single search; dead engines are replaced on return, and
+    # idle engines are pinged periodically so hung ones get replaced too.
+
+    def __init__(self, size: int, path: str = None, health_check_interval: float = 30.0,
+                 ping_timeout: float = 5.0, options: dict = None):
+        self.size = size
+        self.path = path or STOCKFISH_PATH
+        self.options = options or {}  # UCI options set on every engine, e.g. {"Skill Level": 5}
+        self.health_check_interval = health_check_interval
+        self.ping_timeout = ping_timeout
+        self._idle = asyncio.Queue()
+        self._health_task = None
+        self._started_at = None
+        self._lease_started = {}
+        self._leased = {}  # id -> protocol, so that close() reaches engines still out on lease
+        self.in_use = 0
+        self.stats = {
+            "leases": 0,
+            "restarts": 0,
+            "health_checks": 0,
+            "failed_health_checks": 0,
+            "max_in_use": 0,
+            "total_wait": 0.0,
+            "max_wait": 0.0,
+            "busy_time": 0.0,
+        }
+
+    async def start(self):
+        for _ in range(self.size):
+            await self._idle.put(await self._spawn())
+        self._started_at = time.perf_counter()
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        # Quits idle engines and those still leased (a game cancelled or
+        # left running); an engine that does not quit in time is killed.
+        if self._health_task:
+            self._health_task.cancel()
+        protocols = list(self._leased.values())
+        self._leased.clear()
+        while not self._idle.empty():
+            protocols.append(self._idle.get_nowait())
+        for protocol in protocols:
+            if protocol is None:
+                continue
+            try:
+                await asyncio.wait_for(protocol.quit(), self.ping_timeout)
+            except Exception:
+                self._kill(protocol)
+
+    async def _spawn(self, attempts: int = 3):
+        for attempt in range(attempts):
+            try:
+                _, protocol = await chess.engine.popen_uci(self.path)
+                if self.options:
+                    await protocol.configure(self.options)
+                return protocol
+            except Exception as e:
+                print(f"Error starting Stockfish (attempt {attempt + 1}/{attempts}): {e}")
+                if attempt + 1 == attempts:
+                    raise
+                await asyncio.sleep(1.0)
+
+    def _kill(self, protocol):
+        try:
+            protocol.transport.kill()
+        except Exception:
+            pass  # Already gone
+
+    async def replace(self, protocol):
+        # Swap a dead or hung engine for a fresh one. A leased engine stays
+        # leased; the caller keeps using the returned replacement. If no
+        # engine can be started the old one stays leased (dead), for the
+        # caller to release or discard.
+        self.stats["restarts"] += 1
+        self._kill(protocol)
+        replacement = await self._spawn()
+        lease_start = self._lease_started.pop(id(protocol), None)
+        if lease_start is not None:
+            self._lease_started[id(replacement)] = lease_start
+        if self._leased.pop(id(protocol), None) is not None:
+            self._leased[id(replacement)] = replacement
+        return replacement
+
+    def _shrink(self):
+        # An engine is lost for good. Once none are left, a None in the idle
+        # queue wakes every waiting acquire() so it fails instead of hanging.
+        self.size -= 1
+        if self.size <= 0:
+            self._idle.put_nowait(None)
+
+    def discard(self, protocol):
+        # Ends a lease whose engine could not be replaced; the pool shrinks.
+        self.in_use -= 1
+        self._leased.pop(id(protocol), None)
+        lease_start = self._lease_started.pop(id(protocol), None)
+        if lease_start is not None:
+            self.stats["busy_time"] += time.perf_counter() - lease_start
+        self._kill(protocol)
+        self._shrink()
+
+    async def acquire(self):
+        wait_start = time.perf_counter()
+        protocol = await self._idle.get()
+        if protocol is None:
+            self._idle.put_nowait(None)
+            raise RuntimeError("no Stockfish engine could be started")
+        wait = time.perf_counter() - wait_start
+        if protocol.returncode.done():
+            try:
+                protocol = await self.replace(protocol)
+            except Exception:
+                self._shrink()
+                raise
+        self.in_use += 1
+        self._lease_started[id(protocol)] = time.perf_counter()
+        self._leased[id(protocol)] = protocol
+        self.stats["leases"] += 1
+        self.stats["total_wait"] += wait
+        self.stats["max_wait"] = max(self.stats["max_wait"], wait)
+        self.stats["max_in_use"] = max(self.stats["max_in_use"], self.in_use)
+        return protocol
+
+    async def release(self, protocol, broken: bool = False):
+        self.in_use -= 1
+        self._leased.pop(id(protocol), None)
+        lease_start = self._lease_started.pop(id(protocol), None)
+        if lease_start is not None:
+            self.stats["busy_time"] += time.perf_counter() - lease_start
+        if broken or protocol.returncode.done():
+            try:
+                protocol = await self.replace(protocol)
+            except Exception:
+                # Keep the pool usable at a reduced size rather than failing
+                # the game that happened to hold the engine.
+                self._shrink()
+                return
+        await self._idle.put(protocol)
+
+    @contextlib.asynccontextmanager
+    async def lease(self):
+        protocol = await self.acquire()
+        broken = False
+        try:
+            yield protocol
+        except chess.engine.EngineTerminatedError:
+            broken = True
+            raise
+        finally:
+            await self.release(protocol, broken)
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            # Only idle engines are checked; leased ones are proven healthy by
+            # the searches they are running.
+            for _ in range(self._idle.qsize()):
+                try:
+                    protocol = self._idle.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if protocol is None:
+                    await self._idle.put(protocol)
+                    continue
+                self.stats["health_checks"] += 1
+                try:
+                    await asyncio.wait_for(protocol.ping(), self.ping_timeout)
+                except Exception as e:
+                    print(f"Stockfish failed health check ({e!r}); replacing it")
+                    self.stats["failed_health_checks"] += 1
+                    try:
+                        protocol = await self.replace(protocol)
+                    except Exception:
+                        self._shrink()
+                        continue
+                await self._idle.put(protocol)
+
+    def utilisation(self) -> float:
+        if not self._started_at or not self.size:
+            return 0.0
+        return self.stats["busy_time"] / (self.size * (time.perf_counter() - self._started_at))
+
+    def print_stats(self):
+        leases = self.stats["leases"]
+        mean_wait = self.stats["total_wait"] / leases if leases else 0.0
+        print(f"\nEngine pool: {self.size} engine(s), {leases} lease(s), peak {self.stats['max_in_use']} in use, "
+              f"utilisation {self.utilisation():.0%}")
+        print(f"  Lease wait: mean {mean_wait * 1000:.1f} ms, max {self.stats['max_wait'] * 1000:.1f} ms")
+        print(f"  Restarts: {self.stats['restarts']}, health checks: {self.stats['health_checks']} "
+              f"({self.stats['failed_health_checks']} failed)")
+
+# Cassettes: a record run writes every LLM answer and every engine play/analyse
+# result to a JSON-lines file; a replay run serves them back from memory, with
+# no network and no Stockfish, to profile the harness itself or to reproduce a
+# game exactly. Records are looked up by kind and key (request hash or FEN)
+# in recorded order; once a key's records are used up, the last one repeats.
+class Cassette:
+    def __init__(self, path: str, mode: str):
+        self.path = path
+        self.mode = mode
+        self._records = defaultdict(deque)
+        self._last = {}
+        self._file = None
+        self._pid = None
+        if mode == "replay":
+            with open(path) as f:
+                for line in f:
+                    record = json.loads(line)
+                    self._records[record["kind"], record["key"]].append(record["data"])
+            print(f"Replaying {sum(len(q) for q in self._records.values())} record(s) from {path}")
+
+    def record(self, kind: str, key: str, data):
+        # Pool workers append to the same file through their own handles.
+        if self._pid != os.getpid():
+            self._file = open(self.path, "a", buffering=1)
+            self._pid = os.getpid()
+        self._file.write(json.dumps({"kind": kind, "key": key, "data": data}) + "\n")
+
+    def next(self, kind: str, key: str):
+        queue = self._records.get((kind, key))
+        if queue:
+            self._last[kind, key] = queue.popleft()
+        elif (kind, key) not in self._last:
+            raise LookupError(f"no {kind} record for {key} in cassette {self.path}")
+        return self._last[kind, key]
+
+def _encode_info(info: dict) -> dict:
+    data = {}
+    if "score" in info:
+        score = info["score"].white()
+        data["mate" if score.is_mate() else "cp"] = score.mate() if score.is_mate() else score.score()
+    if "pv" in info:
+        data["pv"] = [move.uci() for move in info["pv"]]
+    return data
+
+def _decode_info(data: dict) -> dict:
+    info = {}
+    if "cp" in data:
+        info["score"] = chess.engine.PovScore(chess.engine.Cp(data["cp"]), chess.WHITE)
+    elif "mate" in data:
+        info["score"] = chess.engine.PovScore(chess.engine.Mate(data["mate"]), chess.WHITE)
+    if "pv" in data:
+        info["pv"] = [chess.Move.from_uci(uci) for uci in data["pv"]]
+    return info
+
+class RecordingEngine:
+    # Passes searches through to a real engine and records their results.
+    def __init__(self, engine, cassette: Cassette):
+        self._engine = engine
+        self._cassette = cassette
+
+    def play(self, board: chess.Board, limit: chess.engine.Limit, **kwargs):
+        result = self._engine.play(board, limit, **kwargs)
+        self._cassette.record("play", board.fen(), {
+            "move": result.move.uci() if result.move else None,
+            "ponder": result.ponder.uci() if result.ponder else None,
+            "info": _encode_info(result.info),
+        })
+        return result
+
+    def analyse(self, board: chess.Board, limit: chess.engine.Limit, **kwargs):
+        info = self._engine.analyse(board, limit, **kwargs)
+        self._cassette.record("analyse", board.fen(), _encode_info(info))
+        return info
+
+    def __getattr__(self, name):
+        return getattr(self._engine, name)
+
+class ReplayEngine:
+    # Stands in for Stockfish, answering from a cassette.
+    def __init__(self, cassette: Cassette):
+        self._cassette = cassette
+
+    def play(self, board: chess.Board, limit: chess.engine.Limit, **kwargs):
+        data = self._cassette.next("play", board.fen())
+        return chess.engine.PlayResult(chess.Move.from_uci(data["move"]) if data["move"] else None,
+                                       chess.Move.from_uci(data["ponder"]) if data["ponder"] else None,
+                                       _decode_info(data["info"]))
+
+    def analyse(self, board: chess.Board, limit: chess.engine.Limit, **kwargs):
+        return _decode_info(self._cassette.next("analyse", board.fen()))
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+cassette = None  # Cassette, installed by configure_cassette
+_cassette_settings = {}
+
+def configure_cassette(mode: str = None, path: str = None, truncate: bool = False):
+    # mode is "record" or "replay". Recording wraps the current engine;
+    # replaying replaces it. A new recording truncates the file (truncate,
+    # in the parent only; pool workers then append), since replay serves
+    # each key's oldest records first.
+    global cassette, engine, _cassette_settings
+    _cassette_settings = dict(mode=mode, path=path)
+    if not mode:
+        cassette = None
+        return
+    if mode == "record" and truncate:
+        open(path, "w").close()
+    cassette = Cassette(path, mode)
+    if mode == "replay":
+        _quit_engine()
+        engine = ReplayEngine(cassette)
+    elif engine:
+        engine = RecordingEngine(engine, cassette)
+
+def build_prompt(board: chess.Board) -> str:
     fen = board.fen()
-    prompt = (
+    return (
         "You are a chess engine. Given the following chess position in FEN format:\n\n"
         f"{fen}\n\n"
         "Please reply with the best move in UCI notation (e.g. e2e4) and nothing else."
     )
 
-    # try:
-    #     response = client.chat.completions.create(
-    #         model="o1-preview",
-    #         # model="o1-preview",
-    #         # model="gpt-4-turbo",
-    #         # model="gpt-3.5-turbo",
-    #         messages=[{"role": "user", "content": prompt}],
-    #         temperature=1,
-    #         max_completion_tokens=1000
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-        #     # model="gpt-4o-mini",
-        #     # model="gpt-4-turbo",
-        #     # model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-            max_tokens=100
-        )
-        move_str = response.choices[0].message.content.strip()
+# Instructions for the "prefix" prompt layout. Providers cache prompt
+# prefixes (OpenAI: from 1024 tokens, in 128-token steps), so everything
+# that is the same for every move goes first, byte for byte identical, and
+# only the position follows. This text is about 1,200 tokens; editing it
+# invalidates the provider's cache once and changes every request key.
+PREFIX_SYSTEM_PROMPT = """\
+You are a chess engine. You are given one chess position at a time and reply with the single best move for the side \
+to move.
+
+Input
+- Each position is given in Forsyth-Edwards Notation (FEN) on a line starting with "Position:".
+- The six FEN fields are: piece placement from rank 8 down to rank 1, the side to move (w or b), castling rights, \
+the en passant target square, the halfmove clock and the fullmove number.
+- Uppercase letters are White pieces and lowercase letters are Black pieces: K king, Q queen, R rook, B bishop, \
+N knight, P pawn. Digits count empty squares.
+- A following line says which side is to move. You always play for that side.
+
+Output
+- Reply with exactly one move in UCI (long algebraic) notation and nothing else: no move numbers, no commentary, \
+no punctuation, no quotes and no code formatting.
+- A UCI move is the starting square followed by the destination square, for example e2e4, g8f6 or d1h5.
+- Promotions add the piece in lowercase: a7a8q promotes to a queen, d2d1n to a knight.
+- Castling is written as the king's move: e1g1 and e1c1 for White, e8g8 and e8c8 for Black.
+- An en passant capture is written as the pawn's move to the target square, for example e5d6.
+
+Rules
+- The move must be legal in the given position. A move that is illegal, malformed or missing loses the game.
+- Never leave or put your own king in check. If you are in check you must get out of check.
+- Only castle if the castling right is still listed in the FEN, the king and rook have not moved, the squares \
+between them are empty, and the king does not pass through or land on an attacked square.
+- A pawn reaching the last rank must promote; choose the queen unless another piece is clearly better.
+- En passant is only possible on the move right after the opponent's two-square pawn push, onto the square given \
+in the en passant field.
+
+How to choose
+- First look for checkmate, then for checks, captures and threats, for both sides.
+- Do not leave pieces undefended, and do not give away material without a clear reason.
+- In the opening, develop knights and bishops, control the centre, and castle early.
+- In the middlegame, improve your worst piece, create threats and look for tactics such as forks, pins and skewers.
+- In the endgame, activate your king and push passed pawns.
+
+Common mistakes to avoid
+- Moving a piece that is not on the starting square you wrote. Read the FEN carefully: files run a to h from \
+White's left, ranks run 1 to 8 from White's side.
+- Moving a pawn backwards or sideways, or capturing straight ahead with a pawn.
+- Jumping over pieces with a bishop, rook or queen. Only the knight jumps.
+- Castling through check, out of check, or after the king or that rook has already moved.
+- Writing the move in standard algebraic notation such as Nf3, exd5, O-O or e8=Q. Always use squares: g1f3, e4d5, \
+e1g1, e7e8q.
+- Capturing your own piece, or moving onto a square occupied by your own piece.
+- Adding text before or after the move. The reply is read by a program that expects only the move.
+
+Examples
+Position: rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1
+Side to move: White
+e2e4
+
+Position: rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1
+Side to move: Black
+c7c5
+
+Position: rnbqkbnr/pppp1ppp/8/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2
+Side to move: Black
+b8c6
+
+Position: r1bqkbnr/pppp1ppp/2n5/1B2p3/4P3/5N2/PPPP1PPP/RNBQK2R b KQkq - 3 3
+Side to move: Black
+a7a6
+
+Position: r1bqk2r/pppp1ppp/2n2n2/2b1p3/2B1P3/3P1N2/PPP2PPP/RNBQ1RK1 b kq - 2 5
+Side to move: Black
+e8g8
+
+Position: rnbqkb1r/ppp1pppp/5n2/3pP3/8/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 3
+Side to move: White
+e5d6
+
+Position: rnbqkbnr/ppp2ppp/4p3/3p4/2PP4/2N5/PP2PPPP/R1BQKBNR b KQkq - 1 3
+Side to move: Black
+g8f6
+
+Position: rnbqkb1r/pp2pppp/3p1n2/8/3NP3/2N5/PPP2PPP/R1BQKB1R b KQkq - 2 5
+Side to move: Black
+a7a6
+
+Position: r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4
+Side to move: White
+h5f7
+
+Position: r3k2r/pppq1ppp/2n1bn2/3pp3/3PP3/2N1BN2/PPPQ1PPP/R3K2R b KQkq - 0 1
+Side to move: Black
+e8c8
+
+Position: 6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1
+Side to move: White
+d1d8
+
+Position: 4r1k1/5ppp/8/8/8/8/5PPP/4R1K1 b - - 0 1
+Side to move: Black
+e8e1
+
+Position: 8/P5k1/8/8/8/8/5K2/8 w - - 0 1
+Side to move: White
+a7a8q
+
+Position: 4k3/8/8/8/8/8/3p2K1/8 b - - 0 1
+Side to move: Black
+d2d1q
+"""
+
+def build_position_prompt(board: chess.Board) -> str:
+    # The variable part of the "prefix" layout, in the format of the examples.
+    return f"Position: {board.fen()}\nSide to move: {'White' if board.turn == chess.WHITE else 'Black'}"
+
+def build_retry_prompt(board: chess.Board, reason: str, list_legal_moves: bool = False) -> str:
+    # Sent after a rejected answer, in the same conversation.
+    prompt = f"That move was rejected: {reason}. "
+    if list_legal_moves:
+        prompt += f"The legal moves are: {' '.join(sorted(move.uci() for move in board.legal_moves))}. "
+    return prompt + "Please reply with a legal move in UCI notation (e.g. e2e4) and nothing else."
+
+# System prompt for --conversation: the prefix layout's instructions plus
+# how the game is told, so it is cached the same way.
+CONVERSATION_PROMPT = PREFIX_SYSTEM_PROMPT + """
+This conversation is one whole game. The first message gives the position. After that, each message only gives \
+your opponent's latest move, and your earlier replies are the moves you played. Keep track of the position yourself.
+"""
+
+def _estimate_tokens(messages: list) -> int:
+    # About 4 characters per token plus a few tokens of message framing;
+    # close enough to decide when a conversation is over its budget.
+    return sum(len(message["content"]) // 4 + 4 for message in messages)
+
+class ConversationStats:
+    # Size of the --conversation contexts actually sent, and how often they
+    # were cut down to the budget. Prompt tokens, latency and invalid moves
+    # are in the telemetry and answer stats, to compare with a stateless run.
+    def __init__(self, samples: int = 10000):
+        self.stats = dict(requests=0, dropped_turns=0, summaries=0)
+        self.messages = deque(maxlen=samples)
+        self.tokens = deque(maxlen=samples)
+
+    def record(self, messages: int, tokens: int):
+        self.stats["requests"] += 1
+        self.messages.append(messages)
+        self.tokens.append(tokens)
+
+    def print_stats(self, label: str = "Conversation"):
+        if not self.stats["requests"]:
+            return
+        print(f"\n{label}: {self.stats['requests']} request(s), {sum(self.messages) / len(self.messages):.1f} "
+              f"messages and about {sum(self.tokens) / len(self.tokens):.0f} prompt tokens per request "
+              f"(max {max(self.tokens)})")
+        print(f"  Context cut to the budget: {self.stats['dropped_turns']} turn(s) dropped by the window, "
+              f"{self.stats['summaries']} summar{'y' if self.stats['summaries'] == 1 else 'ies'}")
+
+conversation_stats = ConversationStats()
+
+class Conversation:
+    # One chat per game (--conversation) instead of a stateless prompt per
+    # move: the first user message gives the position, later ones only the
+    # opponent's reply, and the assistant turns are the moves GPT played.
+    # The messages are rebuilt from the board's move stack for every
+    # request, so rejected answers never enter the history. Once the prompt
+    # is over `budget` tokens, "window" drops the oldest turns and restarts
+    # from the position at the new first turn, while "summary" replaces the
+    # whole history with the current position and the last few moves. A
+    # full window changes the start of the conversation on every move, so
+    # only the system prompt stays in the provider's prefix cache; after a
+    # summary the history is byte-stable again until the next one.
+    def __init__(self, strategy: str = "window", budget: int = 2048, summary_plies: int = 8):
+        self.strategy = strategy
+        self.budget = budget
+        self.summary_plies = summary_plies
+        self.start = None  # ply of the first turn in the context
+        self.summarized = False
+        self._position = (None, None)  # (start, text) of the first user message
+
+    def _position_message(self, board: chess.Board) -> str:
+        if self._position[0] != self.start:
+            position = board.root()
+            recent = []
+            for ply, move in enumerate(board.move_stack[:self.start]):
+                if self.summarized and ply >= self.start - self.summary_plies:
+                    recent.append(position.san(move))
+                position.push(move)
+            text = build_position_prompt(position)
+            if recent:
+                text += f"\nLast moves: {' '.join(recent)}"
+            self._position = (self.start, text)
+        return self._position[1]
+
+    def _messages(self, board: chess.Board) -> list:
+        moves = board.move_stack
+        opponent = "White" if board.turn == chess.BLACK else "Black"
+        messages = [{"role": "system", "content": CONVERSATION_PROMPT},
+                    {"role": "user", "content": self._position_message(board)}]
+        for ply in range(self.start, len(moves) - 1, 2):
+            messages.append({"role": "assistant", "content": moves[ply].uci()})
+            messages.append({"role": "user", "content": f"{opponent} played {moves[ply + 1].uci()}."})
+        return messages
+
+    def messages(self, board: chess.Board) -> list:
+        ply = len(board.move_stack)
+        if self.start is None:
+            self.start = ply
+        messages = self._messages(board)
+        tokens = _estimate_tokens(messages)
+        if tokens > self.budget and self.start < ply:
+            if self.strategy == "summary":
+                self.start, self.summarized = ply, True
+                conversation_stats.stats["summaries"] += 1
+                messages = self._messages(board)
+                tokens = _estimate_tokens(messages)
+            while tokens > self.budget and self.start < ply:
+                self.start += 2
+                conversation_stats.stats["dropped_turns"] += 1
+                messages = self._messages(board)
+                tokens = _estimate_tokens(messages)
+        conversation_stats.record(len(messages), tokens)
+        return messages
+
+def _move_request(board: chess.Board, model: str = "gpt-4o", seed: int = None, response_format: str = "text",
+                  feedback: list = None, list_legal_moves: bool = False, prompt_layout: str = "inline",
+                  conversation: Conversation = None) -> dict:
+    # Keyword arguments for chat.completions.create, shared by the sync and
+    # async clients. With response_format="json_schema" the answer is a JSON
+    # object whose "move" must be one of the legal moves (structured outputs),
+    # so the model cannot answer with a malformed or illegal move. feedback
+    # holds (answer, reason) for earlier rejected answers to this position.
+    # prompt_layout="prefix" sends PREFIX_SYSTEM_PROMPT as a system message
+    # and only the position as the user message, so the provider can reuse
+    # its cached prefix; "inline" is the original single prompt with the FEN
+    # in the middle. (A json_schema response_format comes before the
+    # messages, and its per-position move list defeats the prefix cache.)
+    # A Conversation replaces the prompt with the game's chat so far.
+    request = dict(
+        model=model,
+        messages=[{"role": "user", "content": build_prompt(board)}],
+        temperature=0,
+        max_tokens=100
+    )
+    if prompt_layout == "prefix":
+        request["messages"] = [{"role": "system", "content": PREFIX_SYSTEM_PROMPT},
+                               {"role": "user", "content": build_position_prompt(board)}]
+    if conversation:
+        request["messages"] = conversation.messages(board)
+    for answer, reason in feedback or ():
+        request["messages"].append({"role": "assistant", "content": answer})
+        request["messages"].append({"role": "user", "content": build_retry_prompt(board, reason, list_legal_moves)})
+    if seed is not None:
+        request["seed"] = seed
+    if response_format == "json_schema":
+        request["response_format"] = {"type": "json_schema", "json_schema": {
+            "name": "chess_move",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {"move": {"type": "string", "enum": sorted(move.uci() for move in board.legal_moves)}},
+                "required": ["move"],
+                "additionalProperties": False,
+            },
+        }}
+    return request
+
+def _answer_text(request: dict, content: str) -> str:
+    # The move string from a completion's content: as sent, or the "move" of
+    # a structured (json_schema) answer.
+    content = (content or "").strip()
+    if "response_format" in request:
+        # Without strict schema enforcement the JSON may not be an object,
+        # or its "move" may be null or a number; those are left as the raw
+        # content for process_ai_move to reject.
+        try:
+            move = json.loads(content)["move"]
+        except (ValueError, KeyError, TypeError, IndexError):
+            move = None
+        if isinstance(move, str):
+            return move
+    return content
+
+# Move tokens in free text: castling (O-O, 0-0-0), UCI or long algebraic
+# (e2e4, e7e8q, e2-e4, Ng1f3, Ng1xf3) and SAN (Nf3, exd5, e8=Q+), with any
+# check, mate or annotation marks. A token only counts once something other
+# than a move character follows it, so a streamed "e7e8" is not taken before
+# its promotion piece.
+MOVE_TOKEN_RE = re.compile(
+    r"(?<![\w-])(?:(?P<castle>[O0]-[O0](?:-[O0])?)"
+    r"|[KQRBNP]?(?P<lan>[a-h][1-8][-x]?[a-h][1-8])=?(?P<lan_promotion>[QRBNqrbn])?"
+    r"|(?P<san>[KQRBN]?[a-h]?[1-8]?x?[a-h][1-8])=?(?P<san_promotion>[QRBNqrbn])?)"
+    r"[+#]?[!?]*(?![\w=-])")
+
+_move_indexes = OrderedDict()  # position key -> legal_move_index, least recently used first
+
+def legal_move_index(board: chess.Board, max_positions: int = 4096) -> dict:
+    # Every legal move of the position under each string it may be written
+    # as: UCI, SAN without check marks or "=", SAN without the "x" of a
+    # capture, and over-disambiguated SAN (Ngf3, Ng1f3). A lenient form that
+    # two moves share is left out. Lookups replace generating legal moves
+    # per check, and building it pushes no moves (unlike Board.san). Indexes
+    # are kept for the last max_positions positions, since a position is
+    # parsed many times (stream prefixes, retries, votes); the key is built
+    # from the bitboards because Board.fen() alone costs more than a lookup.
+    key = (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+           board.occupied_co[chess.WHITE], board.turn, board.castling_rights, board.ep_square, board.chess960)
+    index = _move_indexes.get(key)
+    if index is not None:
+        _move_indexes.move_to_end(key)
+        return index
+    moves = list(board.legal_moves)
+    rivals = defaultdict(list)  # (piece type, target) -> legal moves
+    for move in moves:
+        rivals[board.piece_type_at(move.from_square), move.to_square].append(move)
+    index, lenient = {}, {}
+    for move in moves:
+        to = chess.SQUARE_NAMES[move.to_square]
+        promotion = chess.piece_symbol(move.promotion) if move.promotion else ""
+        index[chess.SQUARE_NAMES[move.from_square] + to + promotion] = move
+        piece = board.piece_type_at(move.from_square)
+        if piece == chess.KING and board.is_castling(move):
+            index["O-O" if board.is_kingside_castling(move) else "O-O-O"] = move
+            continue
+        to += promotion.upper()
+        from_file = chess.FILE_NAMES[chess.square_file(move.from_square)]
+        from_rank = chess.RANK_NAMES[chess.square_rank(move.from_square)]
+        if piece == chess.PAWN:
+            # A pawn that changes file captures (en passant included).
+            index[from_file + "x" + to if from_file != to[0] else to] = move
+            continue
+        capture = "x" if board.piece_type_at(move.to_square) else ""
+        letter = chess.piece_symbol(piece).upper()
+        others = [other.from_square for other in rivals[piece, move.to_square] if other != move]
+        if not others:
+            disambiguation = ""
+        elif all(chess.square_file(other) != chess.square_file(move.from_square) for other in others):
+            disambiguation = from_file
+        elif all(chess.square_rank(other) != chess.square_rank(move.from_square) for other in others):
+            disambiguation = from_rank
+        else:
+            disambiguation = from_file + from_rank
+        index[letter + disambiguation + capture + to] = move
+        for extra in {disambiguation, from_file, from_rank, from_file + from_rank}:
+            for variant in (letter + extra + capture + to, letter + extra + to):
+                lenient[variant] = None if lenient.get(variant, move) != move else move
+    for variant, move in lenient.items():
+        if move is not None:
+            index.setdefault(variant, move)
+    _move_indexes[key] = index
+    if len(_move_indexes) > max_positions:
+        _move_indexes.popitem(last=False)
+    return index
+
+def extract_move(board: chess.Board, text: str, final: bool = True):
+    # First legal move in free text, and the form it was written in ("uci",
+    # "long algebraic" or "san"); (None, None) if there is none. With
+    # final=False the text is a stream prefix and a token touching the end
+    # may still be growing, so it is skipped.
+    if final:
+        # The common case, a bare UCI answer, needs no index.
+        try:
+            move = chess.Move.from_uci(text.strip())
+        except ValueError:
+            pass
+        else:
+            if move and board.is_legal(move):
+                return move, "uci"
+    index = legal_move_index(board)
+    for match in MOVE_TOKEN_RE.finditer(text):
+        if not final and match.end() == len(text):
+            break
+        if match.group("castle"):
+            move, form = index.get(match.group("castle").replace("0", "O")), "san"
+        elif match.group("lan"):
+            uci = match.group("lan").replace("-", "").replace("x", "") + (match.group("lan_promotion") or "").lower()
+            move = index.get(uci)
+            form = "uci" if match.group(0).rstrip("+#!?") == uci else "long algebraic"
+        else:
+            move, form = index.get(match.group("san") + (match.group("san_promotion") or "").upper()), "san"
+        if move is not None:
+            return move, form
+    return None, None
+
+def _latency_summary(samples) -> str:
+    if not samples:
+        return "n/a"
+    ordered = sorted(samples)
+    return (f"mean {sum(ordered) / len(ordered) * 1000:.0f} ms, p50 {ordered[len(ordered) // 2] * 1000:.0f} ms, "
+            f"p95 {ordered[int(len(ordered) * 0.95)] * 1000:.0f} ms")
+
+class AnswerStats:
+    # GPT's answers per response format: how long each took (API call, or
+    # cache hit) and how many process_ai_move rejected.
+    def __init__(self, samples: int = 10000):
+        self.samples = samples
+        self.modes = {}
+        self.attempts = defaultdict(int)  # attempts per GPT move -> moves
+        self.rejected_moves = 0  # moves where every attempt was rejected
+        self.forms = defaultdict(int)  # notation of accepted answers (see extract_move) -> answers
+
+    def record(self, mode: str, latency: float, valid: bool):
+        entry = self.modes.setdefault(mode, dict(answers=0, invalid=0, latencies=deque(maxlen=self.samples)))
+        entry["answers"] += 1
+        entry["invalid"] += not valid
+        entry["latencies"].append(latency)
+
+    def record_form(self, form: str):
+        self.forms[form] += 1
+
+    def record_attempts(self, attempts: int, accepted: bool):
+        self.attempts[attempts] += 1
+        self.rejected_moves += not accepted
+
+    def merge(self, other: "AnswerStats"):
+        # Adds a pool worker's stats (see _take_worker_stats).
+        for mode, theirs in other.modes.items():
+            entry = self.modes.setdefault(mode, dict(answers=0, invalid=0, latencies=deque(maxlen=self.samples)))
+            entry["answers"] += theirs["answers"]
+            entry["invalid"] += theirs["invalid"]
+            entry["latencies"].extend(theirs["latencies"])
+        for attempts, moves in other.attempts.items():
+            self.attempts[attempts] += moves
+        for form, answers in other.forms.items():
+            self.forms[form] += answers
+        self.rejected_moves += other.rejected_moves
+
+    def print_stats(self, label: str = "GPT answers"):
+        for mode, entry in sorted(self.modes.items()):
+            print(f"\n{label} ({mode}): {entry['answers']} answer(s), {entry['invalid']} invalid "
+                  f"({entry['invalid'] / entry['answers']:.1%})")
+            print(f"  Latency: {_latency_summary(entry['latencies'])}")
+        if set(self.forms) - {"uci"}:
+            print(f"\n{label}: accepted answers by notation: "
+                  + ", ".join(f"{form} {count}" for form, count in sorted(self.forms.items())))
+        if max(self.attempts, default=1) > 1:
+            print(f"\n{label}: attempts per move (attempts : moves), {self.rejected_moves} move(s) rejected on every "
+                  f"attempt:")
+            for attempts in sorted(self.attempts):
+                print(f"  {attempts}: {self.attempts[attempts]}")
+
+answer_stats = AnswerStats()
+
+class StreamStats:
+    # Latency of streamed move requests: time to the first content token and
+    # time until a legal move had been parsed, after which the rest of the
+    # stream is dropped.
+    def __init__(self, samples: int = 10000):
+        self.stats = dict(requests=0, early_stops=0, no_move=0)
+        self.first_token = deque(maxlen=samples)
+        self.to_move = deque(maxlen=samples)
+
+    def record(self, first_token: float, to_move: float, early: bool, found: bool = True):
+        self.stats["requests"] += 1
+        self.stats["early_stops"] += early
+        self.stats["no_move"] += not found
+        if first_token is not None:
+            self.first_token.append(first_token)
+        self.to_move.append(to_move)
+
+
+    def print_stats(self, label: str = "Streaming"):
+        if not self.stats["requests"]:
+            return
+        print(f"\n{label}: {self.stats['requests']} request(s), {self.stats['early_stops']} stopped early, "
+              f"{self.stats['no_move']} without a legal move")
+        print(f"  Time to first token: {_latency_summary(self.first_token)}")
+        print(f"  Time to move: {_latency_summary(self.to_move)}")
+
+class LogHistogram:
+    # Constant-memory histogram of positive values (seconds or token counts)
+    # on a log scale: SUBBUCKETS buckets per power of two from 2**LOW to
+    # 2**HIGH, so percentiles are within about 4% however many values are
+    # added. add() is a log2 and a list increment, well under a microsecond.
+    SUBBUCKETS = 8
+    LOW, HIGH = -20, 24
+    __slots__ = ("counts", "count", "max")
+
+    def __init__(self):
+        self.counts = [0] * ((self.HIGH - self.LOW) * self.SUBBUCKETS + 1)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, value: float, _log2=math.log2, _subbuckets=SUBBUCKETS, _offset=-LOW * SUBBUCKETS,
+            _last=(HIGH - LOW) * SUBBUCKETS):
+        self.count += 1
+        if value > self.max:
+            self.max = value
+        index = int(_log2(value) * _subbuckets) + _offset if value > 0 else 0
+        if index < 0:
+            index = 0
+        elif index > _last:
+            index = _last
+        self.counts[index] += 1
+
+    def percentile(self, q: float) -> float:
+        rank, seen = q * self.count, 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(2 ** (self.LOW + (index + 0.5) / self.SUBBUCKETS), self.max)
+        return self.max
+
+    def merge(self, other: "LogHistogram"):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+# USD per million (prompt, completion, cached prompt) tokens, for the cost
+# column of the telemetry report. Models not listed here are reported
+# without a cost.
+MODEL_PRICES = {"gpt-4o": (2.50, 10.00, 1.25), "gpt-4o-mini": (0.15, 0.60, 0.075),
+                "gpt-4-turbo": (10.00, 30.00, 10.00), "gpt-3.5-turbo": (0.50, 1.50, 0.50),
+                "o1-preview": (15.00, 60.00, 7.50)}
+
+def _cached_tokens(usage) -> int:
+    # Prompt tokens served from the provider's prefix cache; the details are
+    # missing for older models and for most OpenAI-compatible servers.
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None) or 0
+
+_current_call = contextvars.ContextVar("llm_call", default=None)
+# The LLMCalls of one Hedger attempt, collected so that a losing attempt's
+# tokens can be charged to hedging.
+_hedge_attempt = contextvars.ContextVar("hedge_attempt", default=None)
+
+class LLMCall:
+    # Timestamps of one API call (one attempt), filled in as it goes: by
+    # _ask/_async_ask, by the streaming loops and, through _current_call, by
+    # ConnectionStats' httpcore trace events. Phases: queue (building the
+    # request in the client, rate controller, waiting for a pooled
+    # connection), connect (TCP + TLS, new connections only), first token
+    # (request sent to first content token, or to the response headers when
+    # not streaming), generation (the rest of the response, minus parsing)
+    # and parse. A call coalesced by the broker onto another game's
+    # upstream request is only counted: the usage belongs to that request.
+    __slots__ = ("telemetry", "model", "start", "sent", "connect", "first_token", "parse", "usage", "cancelled",
+                 "coalesced", "_token")
+
+    def __init__(self, telemetry, model: str):
+        self.telemetry = telemetry
+        self.model = model
+        self.sent = self.first_token = self.usage = None
+        self.connect = self.parse = 0.0
+        self.cancelled = self.coalesced = False
+
+    def __enter__(self):
+        self._token = _current_call.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_call.reset(self._token)
+        if exc_type is asyncio.CancelledError:
+            self.cancelled = True
+        self.telemetry.finish(self, failed=exc_type is not None and not self.cancelled)
+        attempt = _hedge_attempt.get()
+        if attempt is not None:
+            attempt.append(self)
+
+class LLMTelemetry:
+    # Per-model latency phases (see LLMCall), token counts and cost of every
+    # chat completion call, in LogHistograms. The first token is also split
+    # by whether the provider reported a prompt prefix cache hit, to show
+    # what the cache saves. print_stats runs at the end of a run and, with
+    # an interval, every `interval` seconds during it.
+    PHASES = ("queue", "connect", "first_token", "generation", "parse", "total")
+
+    def __init__(self, interval: float = 0.0):
+        self.interval = interval
+        self.next_report = time.perf_counter() + interval
+        self.models = {}
+
+    def call(self, request: dict) -> LLMCall:
+        return LLMCall(self, request.get("model", "?"))
+
+    def _model(self, model: str) -> dict:
+        entry = self.models.get(model)
+        if entry is None:
+            entry = self.models[model] = dict(calls=0, coalesced=0, failed=0, cancelled=0, no_usage=0, prompt_tokens=0,
+                                              completion_tokens=0, cached_tokens=0, cache_hits=0,
+                                              **{name: LogHistogram() for name in self.PHASES},
+                                              prompt=LogHistogram(), completion=LogHistogram(),
+                                              first_token_cached=LogHistogram(),
+                                              first_token_uncached=LogHistogram())
+        return entry
+
+    def finish(self, call: LLMCall, failed: bool = False):
+        end = time.perf_counter()
+        entry = self._model(call.model)
+        if call.coalesced and not call.cancelled:
+            entry["coalesced"] += 1
+        else:
+            self._record(entry, call, failed, end)
+        self.report_if_due(end)
+
+    def report_if_due(self, now: float = None):
+        # The periodic report; pool workers leave it to the parent, which
+        # calls this after merging each worker's stats.
+        now = now or time.perf_counter()
+        if self.interval and now >= self.next_report:
+            self.next_report = now + self.interval
+            self.print_stats("LLM telemetry so far")
+
+    def _record(self, entry: dict, call: LLMCall, failed: bool, end: float):
+        entry["calls"] += 1
+        if failed or call.cancelled:
+            entry["failed" if failed else "cancelled"] += 1
+        else:
+            if call.sent is not None:  # None for brokered calls, sent from the broker's task
+                first_token = call.first_token or end
+                entry["queue"].add(call.sent - call.start - call.connect)
+                if call.connect:
+                    entry["connect"].add(call.connect)
+                entry["first_token"].add(first_token - call.sent)
+                entry["generation"].add(max(end - first_token - call.parse, 0.0))
+            entry["parse"].add(call.parse)
+            entry["total"].add(end - call.start)
+            usage = call.usage
+            if usage is None:
+                entry["no_usage"] += 1
+            else:
+                prompt_tokens, completion_tokens = usage.prompt_tokens or 0, usage.completion_tokens or 0
+                cached_tokens = _cached_tokens(usage)
+                entry["prompt"].add(prompt_tokens)
+                entry["completion"].add(completion_tokens)
+                entry["prompt_tokens"] += prompt_tokens
+                entry["completion_tokens"] += completion_tokens
+                entry["cached_tokens"] += cached_tokens
+                entry["cache_hits"] += cached_tokens > 0
+                if call.sent is not None:
+                    entry["first_token_cached" if cached_tokens else "first_token_uncached"].add(
+                        (call.first_token or end) - call.sent)
+
+    def merge(self, models: dict):
+        # Adds a pool worker's per-model entries (see _take_worker_stats).
+        for model, theirs in models.items():
+            entry = self._model(model)
+            for name, value in theirs.items():
+                if isinstance(value, LogHistogram):
+                    entry[name].merge(value)
+                else:
+                    entry[name] += value
+
+    def print_stats(self, label: str = "LLM telemetry"):
+        for model, entry in sorted(self.models.items()):
+            prices = MODEL_PRICES.get(model)
+            cached, uncached = entry["cached_tokens"], entry["prompt_tokens"] - entry["cached_tokens"]
+            cost = ""
+            if prices:
+                dollars = uncached * prices[0] + cached * prices[2] + entry["completion_tokens"] * prices[1]
+                cost = f", ${dollars / 1e6:.4f}"
+            print(f"\n{label} ({model}): {entry['calls']} call(s), {entry['failed']} failed, "
+                  f"{entry['cancelled']} cancelled, {entry['prompt_tokens']} prompt ({cached} cached) + "
+                  f"{entry['completion_tokens']} completion tokens{cost}")
+            if entry["coalesced"]:
+                print(f"  {entry['coalesced']} more answer(s) coalesced onto these calls (no tokens of their own)")
+            print(f"  {'phase':<14}{'p50':>11}{'p90':>11}{'p99':>11}{'max':>11}")
+            # The cache split is only shown once there was a cache hit.
+            split = ("first_token_cached", "first_token_uncached") if entry["cache_hits"] else ()
+            for name in self.PHASES + split:
+                histogram = entry[name]
+                if histogram.count:
+                    values = [histogram.percentile(q) * 1000 for q in (0.5, 0.9, 0.99)] + [histogram.max * 1000]
+                    label_text = name.replace("first_token_", "ft ").replace("_", " ")
+                    print(f"  {label_text:<14}" + "".join(f"{value:>8.2f} ms" for value in values))
+            for name in ("prompt", "completion"):
+                histogram = entry[name]
+                if histogram.count:
+                    values = [histogram.percentile(q) for q in (0.5, 0.9, 0.99)] + [histogram.max]
+                    print(f"  {name + ' tokens':<14}" + "".join(f"{value:>11.0f}" for value in values))
+            if entry["cache_hits"]:
+                print(f"  prompt cache: {entry['cache_hits']} call(s) with a hit, "
+                      f"{cached / max(entry['prompt_tokens'], 1):.1%} of prompt tokens cached")
+            if entry["no_usage"]:
+                print(f"  {entry['no_usage']} call(s) without usage (streams stopped early)")
+
+llm_telemetry = LLMTelemetry()
+
+class Hedger:
+    # Hedged requests: if an answer has not arrived after `delay` seconds (by
+    # default the rolling `percentile` of recent latencies), a duplicate
+    # request goes out and whichever succeeds first wins. Async losers are
+    # cancelled outright; sync attempts run in threads, where a streaming
+    # loser stops at its next chunk but a non-streaming one is abandoned: it
+    # finishes in the background and is ignored. Whatever tokens the losers
+    # report are the extra cost of hedging.
+    def __init__(self, delay: float = None, percentile: float = 0.9, initial_delay: float = 2.0,
+                 min_samples: int = 20, samples: int = 1000):
+        self.fixed_delay = delay
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=samples)
+        self._pool = None
+        self._lock = threading.Lock()
+        self.stats = dict(calls=0, hedges=0, hedge_wins=0, cancelled=0, abandoned=0, total_delay=0.0,
+                          extra_prompt_tokens=0, extra_completion_tokens=0, extra_cost=0.0)
+
+    def delay(self) -> float:
+        if self.fixed_delay is not None:
+            return self.fixed_delay
+        if len(self.latencies) < self.min_samples:
+            return self.initial_delay
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))]
+
+    def _timed(self, call, cancel: threading.Event, calls: list):
+        token = _hedge_attempt.set(calls)
+        try:
+            start = time.perf_counter()
+            result = call(cancel)
+        finally:
+            _hedge_attempt.reset(token)
+        if not cancel.is_set():  # a cancelled stream returns early, which would skew the percentile
+            self.latencies.append(time.perf_counter() - start)
+        return result
+
+    def _settle(self, calls: list, future):
+        # Done callback of a losing attempt. A failed one cost nothing.
+        if not future.cancelled() and future.exception() is not None:
+            return
+        with self._lock:
+            cut_short = future.cancelled() or any(call.cancelled for call in calls)
+            self.stats["cancelled" if cut_short else "abandoned"] += 1
+            for call in calls:
+                if call.usage is None or call.coalesced:
+                    continue
+                prompt, completion = call.usage.prompt_tokens or 0, call.usage.completion_tokens or 0
+                cached = _cached_tokens(call.usage)
+                self.stats["extra_prompt_tokens"] += prompt
+                self.stats["extra_completion_tokens"] += completion
+                prices = MODEL_PRICES.get(call.model)
+                if prices:
+                    self.stats["extra_cost"] += ((prompt - cached) * prices[0] + cached * prices[2]
+                                                 + completion * prices[1]) / 1e6
+
+    def run(self, call):
+        # call(cancel) does one attempt; cancel is a threading.Event set when
+        # the other attempt has won.
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hedge")
+        self.stats["calls"] += 1
+        delay = self.delay()
+        primary_cancel, primary_calls = threading.Event(), []
+        primary = self._pool.submit(self._timed, call, primary_cancel, primary_calls)
+        attempts = {primary: (primary_cancel, primary_calls)}
+        if not wait([primary], timeout=delay).done:
+            self.stats["hedges"] += 1
+            self.stats["total_delay"] += delay
+            hedge_cancel, hedge_calls = threading.Event(), []
+            attempts[self._pool.submit(self._timed, call, hedge_cancel, hedge_calls)] = (hedge_cancel, hedge_calls)
+        pending, error = set(attempts), None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self.stats["hedge_wins"] += future is not primary
+                    for loser, (cancel, calls) in attempts.items():
+                        if loser is not future:
+                            cancel.set()
+                            loser.add_done_callback(functools.partial(self._settle, calls))
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    async def _timed_async(self, coroutine, calls: list):
+        _hedge_attempt.set(calls)  # the task's own context
+        start = time.perf_counter()
+        result = await coroutine
+        self.latencies.append(time.perf_counter() - start)
+        return result
+
+    async def run_async(self, make_call):
+        # make_call(hedge) returns the coroutine for one attempt; hedge is
+        # True for the duplicate.
+        self.stats["calls"] += 1
+        delay = self.delay()
+        primary_calls = []
+        primary = asyncio.ensure_future(self._timed_async(make_call(False), primary_calls))
+        attempts = {primary: primary_calls}
+        pending, winner = {primary}, None
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                self.stats["hedges"] += 1
+                self.stats["total_delay"] += delay
+                hedge_calls = []
+                hedge = asyncio.ensure_future(self._timed_async(make_call(True), hedge_calls))
+                attempts[hedge] = hedge_calls
+                pending.add(hedge)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        self.stats["hedge_wins"] += task is not primary
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task, calls in attempts.items():
+                if task is not winner:
+                    task.cancel()
+                    task.add_done_callback(functools.partial(self._settle, calls))
+
+    def print_stats(self, label: str = "Hedged requests"):
+        calls, hedges = self.stats["calls"], self.stats["hedges"]
+        if not calls:
+            return
+        mean_delay = self.stats["total_delay"] / hedges if hedges else self.delay()
+        print(f"\n{label}: {calls} call(s), {hedges} hedge(s) sent (+{hedges / calls:.1%} requests), "
+              f"{self.stats['hedge_wins']} won by the hedge")
+        print(f"  Losers: {self.stats['cancelled']} cancelled, {self.stats['abandoned']} abandoned (ran to the end), "
+              f"mean hedge delay {mean_delay * 1000:.0f} ms")
+        extra_tokens = self.stats["extra_prompt_tokens"] + self.stats["extra_completion_tokens"]
+        cost = f", ${self.stats['extra_cost']:.4f}" if self.stats["extra_cost"] else ""
+        print(f"  Extra spent on losers: {self.stats['extra_prompt_tokens']} prompt + "
+              f"{self.stats['extra_completion_tokens']} completion tokens ({extra_tokens} total){cost}")
+
+class SelfConsistency:
+    # Self-consistency voting: `samples` answers for the same position at a
+    # nonzero temperature, either as one request with n=samples or as that
+    # many concurrent requests (for servers without n), and the legal move
+    # most of them agree on is played. Concurrent samples cost the slowest
+    # sample's latency, not the sum. If no sample is legal the first answer
+    # is returned, so process_ai_move rejects it as usual.
+    def __init__(self, samples: int = 5, mode: str = "n", temperature: float = 0.7, latency_samples: int = 10000):
+        self.samples = samples
+        self.mode = mode
+        self.temperature = temperature
+        self._pool = None
+        self.stats = dict(moves=0, samples=0, failed_samples=0, legal=0, winner_votes=0, unanimous=0, no_legal=0,
+                          rescued=0, requests=0, prompt_tokens=0, completion_tokens=0)
+        self.model = None
+        self.latencies = deque(maxlen=latency_samples)  # per move
+        self.sample_latencies = deque(maxlen=latency_samples)  # per request
+
+    def prepare(self, request: dict) -> dict:
+        # The request as cached and keyed: n and temperature included in
+        # both modes, so a voted answer never comes from a single-sample entry.
+        return dict(request, n=self.samples, temperature=self.temperature)
+
+    def _requests(self, request: dict) -> list:
+        if self.mode == "n":
+            return [request]
+        single = {key: value for key, value in request.items() if key != "n"}
+        seed = request.get("seed")
+        return [single if seed is None else dict(single, seed=seed + i) for i in range(self.samples)]
+
+    def _vote(self, request: dict, board: chess.Board, results: list, start: float) -> str:
+        answers, errors = [], []
+        for result in results:
+            if isinstance(result, Exception):
+                errors.append(result)
+                continue
+            sample_answers, usage, latency = result
+            answers += sample_answers
+            self.sample_latencies.append(latency)
+            if usage is not None:
+                self.stats["prompt_tokens"] += usage.prompt_tokens or 0
+                self.stats["completion_tokens"] += usage.completion_tokens or 0
+        self.stats["failed_samples"] += len(errors) * (self.samples // len(results))
+        if not answers:
+            raise errors[0]
+        self.model = request.get("model")
+        self.stats["moves"] += 1
+        self.stats["requests"] += len(results) - len(errors)
+        self.stats["samples"] += len(answers)
+        moves = [extract_move(board, answer)[0] for answer in answers]
+        legal = [move.uci() for move in moves if move is not None]
+        self.latencies.append(time.perf_counter() - start)
+        self.stats["legal"] += len(legal)
+        if not legal:
+            self.stats["no_legal"] += 1
+            return answers[0]
+        # most_common keeps first-seen order among ties, so a tie goes to the earliest sample.
+        move, votes = Counter(legal).most_common(1)[0]
+        self.stats["winner_votes"] += votes
+        self.stats["unanimous"] += votes == len(answers)
+        self.stats["rescued"] += moves[0] is None
+        return move
+
+    def run(self, request: dict, board: chess.Board) -> str:
+        start = time.perf_counter()
+        requests = self._requests(request)
+        if len(requests) == 1:
+            return self._vote(request, board, [_sample(requests[0])], start)
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.samples, thread_name_prefix="vote")
+        futures = [self._pool.submit(_sample, sample_request) for sample_request in requests]
+        results = [future.exception() or future.result() for future in futures]
+        return self._vote(request, board, results, start)
+
+    async def run_async(self, request: dict, board: chess.Board) -> str:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(_async_sample(sample_request) for sample_request in self._requests(request)),
+                                       return_exceptions=True)
+        return self._vote(request, board, results, start)
+
+    def print_stats(self, label: str = "Self-consistency voting"):
+        s = self.stats
+        if not s["moves"]:
+            return
+        print(f"\n{label}: {s['moves']} move(s), {self.samples} sample(s) each ({self.mode} mode, "
+              f"temperature {self.temperature}), {s['failed_samples']} sample(s) lost to errors")
+        print(f"  Legal samples: {s['legal']}/{s['samples']} ({s['legal'] / s['samples']:.1%}); agreement "
+              f"{s['winner_votes'] / s['samples']:.1%} of samples on the played move, {s['unanimous']} unanimous")
+        print(f"  Moves saved by the vote (first sample illegal): {s['rescued']}; no legal sample: {s['no_legal']}")
+        print(f"  Latency per move: {_latency_summary(self.latencies)}")
+        print(f"  Latency per request: {_latency_summary(self.sample_latencies)}")
+        # One sample would have paid for one request's prompt and a
+        # samples-th of the completion tokens.
+        prompt, completion = s["prompt_tokens"] / s["moves"], s["completion_tokens"] / s["moves"]
+        single_prompt, single_completion = s["prompt_tokens"] / max(s["requests"], 1), completion / self.samples
+        if prompt + completion:
+            print(f"  Tokens per move: {prompt:.0f} prompt + {completion:.0f} completion "
+                  f"({(prompt + completion) / (single_prompt + single_completion):.1f}x one sample)")
+        prices = MODEL_PRICES.get(self.model)
+        if prices and prompt + completion:
+            cost = (prompt * prices[0] + completion * prices[1]) / 1e6
+            single_cost = (single_prompt * prices[0] + single_completion * prices[1]) / 1e6
+            print(f"  Cost per move: ${cost:.5f}, +${cost - single_cost:.5f} over one sample")
+
+class LLMUnavailableError(Exception):
+    # The API could not answer (retries exhausted, or an error that retrying
+    # cannot fix such as bad credentials). The game is abandoned rather than
+    # scored as an invalid move.
+    pass
+
+def _classify_error(e: Exception) -> str:
+    # "outage": timeouts, connection errors and 5xx; retried, and counted by
+    # the circuit breaker. "throttled": 429; retried, but the upstream is up.
+    # "fatal": everything else (auth, bad request, bugs); not retried.
+    if isinstance(e, APIConnectionError):  # includes APITimeoutError
+        return "outage"
+    if isinstance(e, APIStatusError):
+        if e.status_code == 429:
+            return "throttled"
+        if e.status_code >= 500 or e.status_code == 408:
+            return "outage"
+    return "fatal"
+
+class CircuitBreaker:
+    # Opens after `threshold` consecutive outage errors. While open, every
+    # caller in the process waits instead of burning its retries; after
+    # `reset_timeout` one trial call goes through (half-open). Success closes
+    # the breaker, failure reopens it for twice as long (up to
+    # `max_reset_timeout`).
+    def __init__(self, threshold: int = 5, reset_timeout: float = 10.0, max_reset_timeout: float = 300.0):
+        self.threshold = threshold
+        self.base_timeout = reset_timeout
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_until = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+        self.stats = dict(opened=0, paused_time=0.0)
+
+    def before_call(self) -> float:
+        # Seconds to wait before asking again; 0 means go ahead.
+        with self._lock:
+            if self.state == "closed":
+                return 0.0
+            now = time.monotonic()
+            if self.state == "open":
+                if now < self.opened_until:
+                    return self.opened_until - now
+                self.state = "half_open"
+            if self._trial:
+                return 0.5
+            self._trial = True
+            return 0.0
+
+    def record(self, ok: bool):
+        with self._lock:
+            if ok:
+                if self.state != "closed":
+                    print("OpenAI API circuit breaker closed; resuming games")
+                self.state, self.failures, self._trial = "closed", 0, False
+                self.reset_timeout = self.base_timeout
+                return
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.threshold):
+                if self.state == "half_open":
+                    self.reset_timeout = min(self.reset_timeout * 2, self.max_reset_timeout)
+                self.state, self._trial = "open", False
+                self.opened_until = time.monotonic() + self.reset_timeout
+                self.stats["opened"] += 1
+                print(f"OpenAI API circuit breaker open after {self.failures} failure(s); "
+                      f"pausing games for {self.reset_timeout:.0f}s")
+
+    def release(self):
+        # The call failed for a reason that says nothing about an outage
+        # (throttled, fatal): leave the state alone, but let the next caller
+        # make the half-open trial instead of waiting on this one forever.
+        with self._lock:
+            self._trial = False
+
+def _parse_retry_after(value) -> float:
+    # Seconds to wait from a retry-after header: either a number of seconds
+    # or an HTTP date. Anything else (or a date in the past) gives 0.0, so
+    # callers fall back to their own delay.
+    if not value:
+        return 0.0
+    try:
+        seconds = float(value)
+    except ValueError:
+        pass
+    else:
+        return max(seconds, 0.0) if math.isfinite(seconds) else 0.0
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return 0.0
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max((when - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+
+class RetryPolicy:
+    # Retries outage and throttling errors with exponential backoff and full
+    # jitter (a 429's retry-after is honoured as a minimum), behind a
+    # circuit breaker. The clients' own retries are off (make_llm_clients)
+    # so that every attempt is classified here.
+    def __init__(self, max_retries: int = 5, base_delay: float = 0.5, max_delay: float = 30.0,
+                 breaker: CircuitBreaker = None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = dict(calls=0, retries=0, gave_up=0, outage=0, throttled=0, fatal=0)
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if isinstance(error, APIStatusError):
+            delay = max(delay, _parse_retry_after(error.response.headers.get("retry-after")))
+        return delay
+
+    def _on_error(self, attempt: int, error: Exception) -> float:
+        # Returns the delay before the next attempt, or raises.
+        kind = _classify_error(error)
+        self.stats[kind] += 1
+        if kind == "outage":
+            self.breaker.record(False)
+        else:
+            self.breaker.release()
+        if kind == "fatal":
+            raise LLMUnavailableError(f"{type(error).__name__}: {error}") from error
+        if attempt >= self.max_retries:
+            self.stats["gave_up"] += 1
+            raise LLMUnavailableError(f"gave up after {attempt + 1} attempt(s): "
+                                      f"{type(error).__name__}: {error}") from error
+        self.stats["retries"] += 1
+        return self._backoff(attempt, error)
+
+    def run(self, call):
+        self.stats["calls"] += 1
+        for attempt in itertools.count():
+            while (pause := self.breaker.before_call()) > 0:
+                self.breaker.stats["paused_time"] += pause
+                time.sleep(pause)
+            try:
+                result = call()
+            except Exception as e:
+                time.sleep(self._on_error(attempt, e))
+            else:
+                self.breaker.record(True)
+                return result
+
+    async def run_async(self, make_call):
+        self.stats["calls"] += 1
+        for attempt in itertools.count():
+            while (pause := self.breaker.before_call()) > 0:
+                self.breaker.stats["paused_time"] += pause
+                await asyncio.sleep(pause)
+            try:
+                result = await make_call()
+            except Exception as e:
+                await asyncio.sleep(self._on_error(attempt, e))
+            else:
+                self.breaker.record(True)
+                return result
+
+    def print_stats(self, label: str = "API retries"):
+        s = self.stats
+        if not (s["retries"] or s["gave_up"] or s["fatal"]):
+            return
+        print(f"\n{label}: {s['calls']} call(s), {s['retries']} retried, {s['gave_up']} gave up")
+        print(f"  Errors: {s['outage']} outage, {s['throttled']} throttled, {s['fatal']} fatal")
+        print(f"  Circuit breaker opened {self.breaker.stats['opened']} time(s), "
+              f"{self.breaker.stats['paused_time']:.0f}s of game time paused")
+
+class LLMCache:
+    # On-disk cache of LLM answers, keyed by a hash of the full request
+    # (model, prompt with the FEN, sampling parameters). With temperature=0
+    # the same request gets the same answer, and every game asks the same
+    # opening questions. Entries expire after `ttl` seconds, and the least
+    # recently used ones are evicted beyond `max_entries`. Hit/miss counters
+    # live in the database so that pool workers share them. Lookups only
+    # read: their last_used times and counter increments are kept in memory
+    # and written in one transaction with the next store, every
+    # `flush_every` lookups, or by flush().
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS responses (
+        key TEXT PRIMARY KEY,
+        model TEXT,
+        response TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        last_used REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+    CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+    """
+    COUNTERS = ("hits", "misses", "expired", "bypassed", "stores", "evictions")
+
+    def __init__(self, path: str, max_entries: int = 100000, ttl: float = None, bypass: bool = False,
+                 flush_every: int = 100):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bypass = bypass
+        self.flush_every = flush_every
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._last_used = {}  # key -> last hit time, not yet written
+        self._pending = Counter()  # counter increments not yet written
+
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite handles must not cross a fork, so each process opens its own.
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(self.SCHEMA)
+            self._conn.executemany("INSERT OR IGNORE INTO counters VALUES (?, 0)", [(c,) for c in self.COUNTERS])
+            self._pid = os.getpid()
+            # A forked worker's copy of the parent's pending updates is the
+            # parent's to write.
+            self._last_used.clear()
+            self._pending.clear()
+        return self._conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # Take the write lock up front instead of upgrading a read lock under
+        # contention.
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    @staticmethod
+    def key(request: dict) -> str:
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+    def _count(self, conn: sqlite3.Connection, name: str, amount: int = 1):
+        conn.execute("UPDATE counters SET value = value + ? WHERE name = ?", (amount, name))
+
+    def _flush(self, conn: sqlite3.Connection):
+        # Writes the pending lookup updates; runs inside a transaction.
+        if self._last_used:
+            conn.executemany("UPDATE responses SET last_used = ? WHERE key = ?",
+                             [(used, key) for key, used in self._last_used.items()])
+        for name, amount in self._pending.items():
+            self._count(conn, name, amount)
+        self._last_used.clear()
+        self._pending.clear()
+
+    def flush(self):
+        with self._transaction() as conn:
+            self._flush(conn)
+
+    def get(self, request: dict):
+        # Read-only; an expired entry is a miss and is overwritten by the
+        # next put.
+        with self._lock:
+            conn = self._connection()
+            if self.bypass:
+                self._pending["bypassed"] += 1
+                row = None
+            else:
+                key = self.key(request)
+                now = time.time()
+                row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row and self.ttl is not None and now - row[1] > self.ttl:
+                    self._pending["expired"] += 1
+                    row = None
+                if row:
+                    self._last_used[key] = now
+                    self._pending["hits"] += 1
+                else:
+                    self._pending["misses"] += 1
+            flush = sum(self._pending.values()) >= self.flush_every
+        if flush:
+            self.flush()
+        return row[0] if row else None
+
+    def put(self, request: dict, response: str):
+        with self._transaction() as conn:
+            self._flush(conn)
+            now = time.time()
+            conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                         (self.key(request), request.get("model"), response, now, now))
+            self._count(conn, "stores")
+            excess = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute("DELETE FROM responses WHERE key IN "
+                             "(SELECT key FROM responses ORDER BY last_used LIMIT ?)", (excess,))
+                self._count(conn, "evictions", excess)
+
+    def counters(self) -> dict:
+        self.flush()
+        with self._lock:
+            return dict(self._connection().execute("SELECT name, value FROM counters").fetchall())
+
+    def print_stats(self, since: dict = None):
+        # `since` is an earlier counters() snapshot, to report just this run.
+        counters = self.counters()
+        delta = {name: counters.get(name, 0) - (since or {}).get(name, 0) for name in self.COUNTERS}
+        lookups = delta["hits"] + delta["misses"]
+        hit_rate = delta["hits"] / lookups if lookups else 0.0
+        print(f"\nLLM cache {self.path}: {delta['hits']} hit(s), {delta['misses']} miss(es) ({hit_rate:.0%} hit rate)")
+        print(f"  Expired: {delta['expired']}, bypassed: {delta['bypassed']}, stored: {delta['stores']}, "
+              f"evicted: {delta['evictions']}")
+
+class ConnectionStats:
+    # Follows httpcore's trace events to see how each request got its
+    # connection: a new one (TCP connect, plus TLS for https) or one kept
+    # alive from an earlier request, and how long it queued for a free slot
+    # when every connection in the pool was busy. The same events time the
+    # connect and first-byte phases of the LLMCall in progress, if any.
+    def __init__(self, max_connections: int = None):
+        self.max_connections = max_connections  # None with HTTP/2, where requests share connections
+        self.busy = 0
+        self.stats = dict(requests=0, opened=0, reused=0, waited=0, total_wait=0.0, max_wait=0.0,
+                          handshake_time=0.0)
+
+    def _event(self, state: dict, name: str):
+        now = time.perf_counter()
+        if name == "connection.connect_tcp.started":
+            self.stats["opened"] += 1
+            state["connect_started"] = now
+        elif name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            state["handshake"] = now - state["connect_started"]
+        elif name.endswith(".send_request_headers.started") and "sent" not in state:
+            state["sent"] = now
+            call = state["call"]
+            if call is not None:
+                call.sent = now
+                call.connect = state.get("handshake", 0.0)
+            self.busy += 1
+            if "connect_started" not in state:
+                self.stats["reused"] += 1
+            else:
+                self.stats["handshake_time"] += state.get("handshake", 0.0)
+            if state["pool_full"]:
+                wait = state.get("connect_started", now) - state["started"]
+                self.stats["waited"] += 1
+                self.stats["total_wait"] += wait
+                self.stats["max_wait"] = max(self.stats["max_wait"], wait)
+        elif name.endswith(".receive_response_headers.complete"):
+            call = state["call"]
+            if call is not None and call.first_token is None:
+                call.first_token = now
+        elif name.endswith(".response_closed.complete") or name.endswith(".response_closed.failed"):
+            self.busy -= 1
+
+    def _start(self) -> dict:
+        self.stats["requests"] += 1
+        return {"started": time.perf_counter(), "call": _current_call.get(),
+                "pool_full": self.max_connections is not None and self.busy >= self.max_connections}
+
+    def on_request(self, request: httpx.Request):
+        # httpx request hook: attaches a per-request trace callback.
+        state = self._start()
+        request.extensions["trace"] = lambda name, info: self._event(state, name)
+
+    async def on_async_request(self, request: httpx.Request):
+        state = self._start()
+
+        async def trace(name, info):
+            self._event(state, name)
+        request.extensions["trace"] = trace
+
+    def print_stats(self, label: str = "HTTP"):
+        s = self.stats
+        if not s["requests"]:
+            return
+        print(f"\n{label} connections: {s['requests']} request(s), {s['opened']} opened, {s['reused']} reused "
+              f"({s['reused'] / s['requests']:.0%})")
+        if s["opened"]:
+            print(f"  Connect + TLS handshake: mean {s['handshake_time'] / s['opened'] * 1000:.1f} ms")
+        if s["waited"]:
+            print(f"  Waited for a pooled connection: {s['waited']} time(s), mean "
+                  f"{s['total_wait'] / s['waited'] * 1000:.1f} ms, max {s['max_wait'] * 1000:.1f} ms")
+
+def make_llm_clients(base_url: str = None, max_connections: int = 100, keepalive_expiry: float = 60.0,
+                     http2: bool = False, timeout: float = 60.0, connect_timeout: float = 5.0):
+    # Builds the sync and async OpenAI clients on explicitly sized httpx
+    # pools. httpx's default keep-alive expiry (5 s) is shorter than a
+    # Stockfish move plus an API call, so without this nearly every move paid
+    # for a fresh TLS handshake. Returns (client, async_client, stats).
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                          keepalive_expiry=keepalive_expiry)
+    timeouts = httpx.Timeout(timeout, connect=connect_timeout)
+    if http2:
+        try:
+            import h2  # noqa: F401  (httpx's optional HTTP/2 support)
+        except ImportError:
+            print("HTTP/2 needs the 'h2' package (pip install httpx[http2]); using HTTP/1.1")
+            http2 = False
+    stats = ConnectionStats(None if http2 else max_connections)
+    http_client = httpx.Client(limits=limits, timeout=timeouts, http2=http2,
+                               event_hooks={"request": [stats.on_request]})
+    async_http_client = httpx.AsyncClient(limits=limits, timeout=timeouts, http2=http2,
+                                          event_hooks={"request": [stats.on_async_request]})
+    # The OpenAI clients pass their own per-request timeout, so it is set on
+    # them as well as on the httpx clients.
+    # Retries are left to RetryPolicy, which classifies every failure.
+    return (OpenAI(api_key=api_key, base_url=base_url, timeout=timeouts, http_client=http_client, max_retries=0),
+            AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=timeouts, http_client=async_http_client,
+                        max_retries=0),
+            stats)
+
+def prewarm_connections():
+    # Opens the configured number of keep-alive connections for the sync
+    # client up front (GET /models is free), so the first moves don't pay for
+    # the handshakes.
+    count = _llm_settings.get("prewarm", 0)
+    if not count:
+        return
+    models = client.with_options(max_retries=0).models
+
+    def touch(_):
+        with contextlib.suppress(APIError):
+            models.list()
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        list(pool.map(touch, range(count)))
+
+async def async_prewarm_connections():
+    count = _llm_settings.get("prewarm", 0)
+    if not count:
+        return
+    models = async_client.with_options(max_retries=0).models
+
+    async def touch():
+        with contextlib.suppress(APIError):
+            await models.list()
+    await asyncio.gather(*(touch() for _ in range(count)))
+
+llm_cache = None  # LLMCache, installed by configure_llm
+http_stats = None  # ConnectionStats for the clients built by configure_llm
+stream_stats = None  # StreamStats; set when configure_llm(stream=True) turns on streaming
+hedger = None  # Hedger; set when configure_llm(hedge=True)
+voter = None  # SelfConsistency; set when configure_llm(vote=K) with K > 1
+retry_policy = None  # RetryPolicy, installed by configure_llm
+move_provider = None  # MoveProvider, installed by configure_llm
+_llm_settings = {}
+
+def configure_llm(cache_path: str = None, cache_max_entries: int = 100000, cache_ttl: float = None,
+                  cache_bypass: bool = False, base_url: str = None, http_options: dict = None,
+                  prewarm: int = 0, stream: bool = False, hedge: bool = False, hedge_delay: float = None,
+                  hedge_percentile: float = 0.9, max_retries: int = 5, breaker_threshold: int = 5,
+                  breaker_timeout: float = 10.0, provider: str = "openai", provider_options: dict = None,
+                  telemetry_interval: float = 0.0, vote: int = 1, vote_mode: str = "n",
+                  vote_temperature: float = 0.7):
+    # Installs the optional LLM-side components for this process. Pool
+    # workers call it again with the same settings. base_url points both
+    # clients at an OpenAI-compatible server such as openai_standin.py;
+    # http_options are passed to make_llm_clients. provider names the
+    # MoveProvider that answers for Black. With telemetry_interval, the LLM
+    # telemetry report is also printed every that many seconds. With vote > 1
+    # every move is a SelfConsistency vote over that many samples.
+    global llm_cache, _llm_settings, client, async_client, http_stats, stream_stats, hedger, retry_policy
+    global move_provider, llm_telemetry, voter
+    _llm_settings = dict(cache_path=cache_path, cache_max_entries=cache_max_entries, cache_ttl=cache_ttl,
+                         cache_bypass=cache_bypass, base_url=base_url, http_options=http_options, prewarm=prewarm,
+                         stream=stream, hedge=hedge, hedge_delay=hedge_delay, hedge_percentile=hedge_percentile,
+                         max_retries=max_retries, breaker_threshold=breaker_threshold,
+                         breaker_timeout=breaker_timeout, provider=provider, provider_options=provider_options,
+                         telemetry_interval=telemetry_interval, vote=vote, vote_mode=vote_mode,
+                         vote_temperature=vote_temperature)
+    client, async_client, http_stats = make_llm_clients(base_url, **(http_options or {}))
+    llm_telemetry = LLMTelemetry(telemetry_interval)
+    stream_stats = StreamStats() if stream else None
+    hedger = Hedger(delay=hedge_delay, percentile=hedge_percentile) if hedge else None
+    voter = SelfConsistency(vote, mode=vote_mode, temperature=vote_temperature) if vote > 1 else None
+    retry_policy = RetryPolicy(max_retries, breaker=CircuitBreaker(breaker_threshold, breaker_timeout))
+    llm_cache = LLMCache(cache_path, max_entries=cache_max_entries, ttl=cache_ttl,
+                         bypass=cache_bypass) if cache_path else None
+    move_provider = MOVE_PROVIDERS[provider](**(provider_options or {}))
+
+def _openai_move(board: chess.Board, **request_options) -> str:
+    # request_options (model, seed, response_format, feedback,
+    # list_legal_moves, prompt_layout, conversation) are passed to
+    # _move_request.
+    request = _move_request(board, **request_options)
+    if voter:
+        request = voter.prepare(request)
+    if cassette:
+        if cassette.mode == "replay":
+            try:
+                return cassette.next("llm", LLMCache.key(request))
+            except LookupError as e:
+                # Nothing was recorded: the recorded game lost the API here
+                # too, so it is abandoned rather than scored as a forfeit.
+                raise LLMUnavailableError(f"replaying OpenAI API answer: {e}") from e
+        move_str = _get_ai_move(request, board)
+        cassette.record("llm", LLMCache.key(request), move_str)
         return move_str
+    return _get_ai_move(request, board)
+
+def _get_ai_move(request: dict, board: chess.Board) -> str:
+    # Raises LLMUnavailableError when the API cannot answer.
+    if llm_cache:
+        cached = llm_cache.get(request)
+        if cached is not None:
+            return cached
+
+    def attempt():
+        if hedger:
+            return hedger.run(functools.partial(_ask, request, board))
+        return _ask(request, board)
+    try:
+        move_str = retry_policy.run(attempt) if retry_policy else attempt()
+    except LLMUnavailableError:
+        raise
     except Exception as e:
-        print(f"Error communicating with OpenAI API: {e}")
-        return ""
+        raise LLMUnavailableError(f"{type(e).__name__}: {e}") from e
+    if llm_cache:
+        llm_cache.put(request, move_str)
+    return move_str
 
-def process_ai_move(board: chess.Board, move_str: str):
+def _ask(request: dict, board: chess.Board, cancel: threading.Event = None) -> str:
+    # One API call for a move (or one vote); cancel (set by Hedger) stops a
+    # stream early.
+    if voter:
+        return voter.run(request, board)
+    with llm_telemetry.call(request) as call:
+        if stream_stats:
+            return _stream_move(request, board, cancel)
+        response = client.chat.completions.create(**request)
+        call.usage = response.usage
+        parse_start = time.perf_counter()
+        move_str = _answer_text(request, response.choices[0].message.content)
+        call.parse = time.perf_counter() - parse_start
+        return move_str
+
+def _sample(request: dict):
+    # One request of a SelfConsistency vote: (answers, usage, latency).
+    start = time.perf_counter()
+    with llm_telemetry.call(request) as call:
+        response = client.chat.completions.create(**request)
+        call.usage = response.usage
+        answers = [_answer_text(request, choice.message.content) for choice in response.choices]
+    return answers, response.usage, time.perf_counter() - start
+
+def _stream_move(request: dict, board: chess.Board, cancel: threading.Event = None) -> str:
+    # Reads the completion as it streams and stops as soon as it contains a
+    # legal move; closing the stream drops the rest of the answer. Returns
+    # the move in UCI, or the whole answer if it has no legal move.
+    # The usage chunk only comes at the end, so a stream stopped early is
+    # recorded without token counts.
+    call = _current_call.get()
+    start = time.perf_counter()
+    first_token = None
+    text = ""
+    stream = client.chat.completions.create(**request, stream=True, stream_options={"include_usage": True})
     try:
-        move = chess.Move.from_uci(move_str)
-    except Exception:
-        print(f"ERROR: The move format '{move_str}' is invalid. AI loses by default.")
+        for chunk in stream:
+            if cancel is not None and cancel.is_set():
+                call.cancelled = True
+                return ""
+            if chunk.usage:
+                call.usage = chunk.usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            now = time.perf_counter()
+            if first_token is None:
+                first_token = now - start
+                call.first_token = now
+            text += delta
+            move = extract_move(board, text, final=False)[0]
+            call.parse += time.perf_counter() - now
+            if move:
+                stream_stats.record(first_token, time.perf_counter() - start, early=True)
+                return move.uci()
+    finally:
+        stream.close()
+    move = extract_move(board, text)[0]
+    stream_stats.record(first_token, time.perf_counter() - start, early=False, found=move is not None)
+    return move.uci() if move else _answer_text(request, text)
+
+def _parse_reset(value) -> float:
+    # OpenAI reports rate-limit resets as durations such as "1s", "6m0s" or "20ms".
+    if not value:
+        return 0.0
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        seconds += float(amount) * {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}[unit]
+    return seconds
+
+class AdaptiveConcurrency:
+    # AIMD limit on in-flight OpenAI calls. The limit grows by about one
+    # request per round trip while the x-ratelimit-remaining-* headers show
+    # headroom, and is cut multiplicatively on a 429, when the remaining
+    # token or request budget drops below `headroom`, or when latency climbs
+    # (the upstream is queueing us). The latency signal is the p90 of the
+    # last `latency_window` calls, against a baseline that follows the same
+    # p90 slowly (an EWMA over about `baseline_calls` calls), so the normal
+    # spread of API latencies and slow drifts do not count as congestion.
+    # Cuts happen at most once per round trip so one burst of bad responses
+    # counts once.
+
+    def __init__(self, initial: int = 8, min_limit: int = 1, max_limit: int = 256, headroom: float = 0.1,
+                 backoff: float = 0.7, latency_factor: float = 2.0, latency_window: int = 50,
+                 baseline_calls: int = 500):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.headroom = headroom
+        self.backoff = backoff
+        self.latency_factor = latency_factor
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._latencies = deque(maxlen=latency_window)
+        self._baseline_alpha = 1.0 / baseline_calls
+        self._baseline = None  # slow EWMA of the windowed p90 latency
+        self._latency_ewma = None
+        self.stats = {"calls": 0, "rate_limited": 0, "increases": 0, "decreases": 0,
+                      "peak_limit": self.limit, "lowest_limit": self.limit}
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def _set_limit(self, limit: float):
+        self.limit = min(self.max_limit, max(self.min_limit, limit))
+        self.stats["peak_limit"] = max(self.stats["peak_limit"], self.limit)
+        self.stats["lowest_limit"] = min(self.stats["lowest_limit"], self.limit)
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < (self._latency_ewma or 0.0):
+            return
+        self._last_decrease = now
+        self.stats["decreases"] += 1
+        self._set_limit(self.limit * self.backoff)
+
+    def on_response(self, headers, latency: float):
+        self.stats["calls"] += 1
+        self._latency_ewma = latency if self._latency_ewma is None else 0.8 * self._latency_ewma + 0.2 * latency
+        self._latencies.append(latency)
+        congested = False
+        if len(self._latencies) == self._latencies.maxlen:
+            p90 = sorted(self._latencies)[int(0.9 * (len(self._latencies) - 1))]
+            if self._baseline is None:
+                self._baseline = p90
+            congested = p90 > self.latency_factor * self._baseline
+            self._baseline += self._baseline_alpha * (p90 - self._baseline)
+
+        budget = 1.0
+        for kind in ("tokens", "requests"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            if remaining is not None and limit:
+                budget = min(budget, float(remaining) / float(limit))
+
+        if budget < self.headroom or congested:
+            self._decrease()
+        elif self.in_flight >= int(self.limit) - 1:
+            # Only grow while the current limit is actually being used.
+            self.stats["increases"] += 1
+            self._set_limit(self.limit + 1.0 / self.limit)
+
+    def on_rate_limited(self, headers) -> float:
+        # Pauses every caller, not just the one that saw the 429, until the
+        # limit resets; returns the pause.
+        self.stats["rate_limited"] += 1
+        self._decrease()
+        wait = _parse_retry_after(headers.get("retry-after")) or max(
+            _parse_reset(headers.get("x-ratelimit-reset-requests")),
+            _parse_reset(headers.get("x-ratelimit-reset-tokens")),
+            1.0)
+        self._paused_until = max(self._paused_until, time.monotonic() + wait)
+        return wait
+
+    def print_stats(self):
+        print(f"\nAdaptive LLM concurrency: final limit {int(self.limit)}, range "
+              f"{int(self.stats['lowest_limit'])}-{int(self.stats['peak_limit'])}, {self.stats['calls']} call(s)")
+        print(f"  429s: {self.stats['rate_limited']}, increases: {self.stats['increases']}, "
+              f"decreases: {self.stats['decreases']}")
+
+rate_controller = None  # Installed by async_simulate_games when adaptive concurrency is enabled
+
+async def _async_chat_completion(request: dict):
+    if not rate_controller:
+        return await async_client.chat.completions.create(**request)
+
+    # The client's own retries would hide 429s from the controller. A 429
+    # only pauses every caller and is re-raised; retrying is left to
+    # RetryPolicy, so the two do not multiply.
+    raw_client = async_client.with_options(max_retries=0).chat.completions.with_raw_response
+    await rate_controller.acquire()
+    try:
+        start = time.perf_counter()
+        raw = await raw_client.create(**request)
+        rate_controller.on_response(raw.headers, time.perf_counter() - start)
+        return raw.parse()
+    except RateLimitError as e:
+        rate_controller.on_rate_limited(e.response.headers)
+        raise
+    finally:
+        await rate_controller.release()
+
+class RequestBroker:
+    # Sits between concurrently running games and the async OpenAI client.
+    # Identical requests (same model, prompt and sampling parameters) that
+    # are in flight at the same time share one upstream call; with
+    # temperature=0 and a deterministic White, every game asks the same
+    # opening questions at roughly the same moment.
+    #
+    # With a window > 0, new requests are held for up to `window` seconds and
+    # sent together, so requests arriving within the window are coalesced
+    # even before the first one has been sent. Distinct positions still go
+    # out as separate chat requests: the endpoint has no multi-prompt call.
+
+    def __init__(self, window: float = 0.0):
+        self.window = window
+        self._in_flight = {}  # request key -> Future shared by all callers
+        self._pending = []  # (request, future, enqueued_at) waiting for the window
+        self._flush_handle = None
+        self._tasks = set()
+        self.stats = {"requests": 0, "upstream_calls": 0, "coalesced": 0, "queue_delay": 0.0}
+
+    @staticmethod
+    def request_key(request: dict) -> str:
+        return json.dumps(request, sort_keys=True)
+
+    async def complete(self, request: dict):
+        self.stats["requests"] += 1
+        key = self.request_key(request)
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            call = _current_call.get()
+            if call is not None:
+                call.coalesced = True
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _, key=key: self._in_flight.pop(key, None))
+            if self.window > 0:
+                self._pending.append((request, future, time.perf_counter()))
+                if self._flush_handle is None:
+                    self._flush_handle = asyncio.get_running_loop().call_later(self.window, self._flush)
+            else:
+                self._dispatch(request, future, time.perf_counter())
+        # A cancelled caller must not cancel the call other games are waiting on.
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        self._flush_handle = None
+        pending, self._pending = self._pending, []
+        for request, future, enqueued_at in pending:
+            self._dispatch(request, future, enqueued_at)
+
+    def _dispatch(self, request: dict, future: asyncio.Future, enqueued_at: float):
+        self.stats["upstream_calls"] += 1
+        self.stats["queue_delay"] += time.perf_counter() - enqueued_at
+        task = asyncio.create_task(self._call(request, future))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _call(self, request: dict, future: asyncio.Future):
+        # The task inherited the context of whichever caller created it, but
+        # the call is shared: keep its trace events out of that caller's
+        # LLMCall. Brokered calls are recorded with parse and total time only.
+        _current_call.set(None)
+        try:
+            response = await _async_chat_completion(request)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(response)
+
+    def print_stats(self):
+        requests = self.stats["requests"]
+        calls = self.stats["upstream_calls"]
+        dedup_ratio = self.stats["coalesced"] / requests if requests else 0.0
+        mean_delay = self.stats["queue_delay"] / calls if calls else 0.0
+        print(f"\nLLM request broker: {requests} request(s), {calls} upstream call(s), "
+              f"dedup ratio {dedup_ratio:.1%}")
+        print(f"  Added queueing delay: mean {mean_delay * 1000:.1f} ms per upstream call (window {self.window * 1000:.0f} ms)")
+
+request_broker = None  # Installed by async_simulate_games when coalescing is enabled
+
+async def _async_stream_move(request: dict, board: chess.Board) -> str:
+    # Async counterpart of _stream_move. Goes through _async_chat_completion
+    # so the rate controller still sees the response headers.
+    call = _current_call.get()
+    start = time.perf_counter()
+    first_token = None
+    text = ""
+    stream = await _async_chat_completion(dict(request, stream=True, stream_options={"include_usage": True}))
+    try:
+        async for chunk in stream:
+            if chunk.usage:
+                call.usage = chunk.usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            now = time.perf_counter()
+            if first_token is None:
+                first_token = now - start
+                call.first_token = now
+            text += delta
+            move = extract_move(board, text, final=False)[0]
+            call.parse += time.perf_counter() - now
+            if move:
+                stream_stats.record(first_token, time.perf_counter() - start, early=True)
+                return move.uci()
+    finally:
+        await stream.close()
+    move = extract_move(board, text)[0]
+    stream_stats.record(first_token, time.perf_counter() - start, early=False, found=move is not None)
+    return move.uci() if move else _answer_text(request, text)
+
+async def _async_sample(request: dict):
+    # Async _sample. It skips the broker, which would coalesce the identical
+    # requests of a vote without seeds into one.
+    start = time.perf_counter()
+    with llm_telemetry.call(request) as call:
+        response = await _async_chat_completion(request)
+        call.usage = response.usage
+        answers = [_answer_text(request, choice.message.content) for choice in response.choices]
+    return answers, response.usage, time.perf_counter() - start
+
+async def _async_ask(request: dict, board: chess.Board, hedge: bool = False) -> str:
+    # One API call for a move (or one vote). A hedged duplicate skips the
+    # broker, which would otherwise coalesce it onto the original request.
+    if voter:
+        return await voter.run_async(request, board)
+    with llm_telemetry.call(request) as call:
+        if stream_stats:
+            return await _async_stream_move(request, board)
+        if request_broker and not hedge:
+            response = await request_broker.complete(request)
+        else:
+            response = await _async_chat_completion(request)
+        call.usage = response.usage
+        parse_start = time.perf_counter()
+        move_str = _answer_text(request, response.choices[0].message.content)
+        call.parse = time.perf_counter() - parse_start
+        return move_str
+
+async def _async_openai_move(board: chess.Board, **request_options) -> str:
+    request = _move_request(board, **request_options)
+    if voter:
+        request = voter.prepare(request)
+    if llm_cache:
+        # SQLite calls run off the event loop; a lock wait would stall every
+        # game on it.
+        cached = await asyncio.to_thread(llm_cache.get, request)
+        if cached is not None:
+            return cached
+
+    def attempt():
+        if hedger:
+            return hedger.run_async(functools.partial(_async_ask, request, board))
+        return _async_ask(request, board)
+    try:
+        move_str = await retry_policy.run_async(attempt) if retry_policy else await attempt()
+    except LLMUnavailableError:
+        raise
+    except Exception as e:
+        raise LLMUnavailableError(f"{type(e).__name__}: {e}") from e
+    if llm_cache:
+        await asyncio.to_thread(llm_cache.put, request, move_str)
+    return move_str
+
+# Move providers: where Black's answers come from. get_ai_move and
+# async_get_ai_move ask the provider installed by configure_llm (OpenAI chat
+# by default). A provider returns the answer as text, normally a UCI move,
+# which process_ai_move then checks like any other answer. New providers
+# register themselves under a name for --provider; --provider-option
+# KEY=VALUE pairs become constructor arguments.
+MOVE_PROVIDERS = {}
+
+def register_provider(name: str):
+    def register(cls):
+        cls.name = name
+        MOVE_PROVIDERS[name] = cls
+        return cls
+    return register
+
+class MoveProvider:
+    name = None
+
+    def get_move(self, board: chess.Board, **request_options) -> str:
+        raise NotImplementedError
+
+    async def async_get_move(self, board: chess.Board, **request_options) -> str:
+        # Providers without an async implementation answer inline.
+        return self.get_move(board, **request_options)
+
+    def close(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+@register_provider("openai")
+class OpenAIChatProvider(MoveProvider):
+    # Chat completions through the clients built by configure_llm, with the
+    # cache, cassettes, retries, hedging and streaming options.
+    def get_move(self, board: chess.Board, **request_options) -> str:
+        return _openai_move(board, **request_options)
+
+    async def async_get_move(self, board: chess.Board, **request_options) -> str:
+        return await _async_openai_move(board, **request_options)
+
+@register_provider("openai-compatible")
+class OpenAICompatibleProvider(OpenAIChatProvider):
+    # The same requests to a local llama.cpp, vLLM or Ollama server (its
+    # OpenAI-compatible /v1 endpoint, set with --base-url). --model names the
+    # model the server has loaded.
+    def __init__(self):
+        if not _llm_settings.get("base_url"):
+            raise ValueError("the openai-compatible provider needs --base-url, e.g. http://127.0.0.1:8080/v1")
+
+@register_provider("uci")
+class UCIEngineProvider(MoveProvider):
+    # A UCI engine playing Black at a chosen strength: Stockfish's skill level
+    # (0-20) or a UCI_Elo limit, searching for `time` seconds (or to `depth`
+    # or `nodes`). The async runner gives it its own pool of `engines`.
+    def __init__(self, path: str = None, skill_level: int = None, elo: int = None, time: float = 0.05,
+                 depth: int = None, nodes: int = None, engines: int = 4):
+        self.path = path or STOCKFISH_PATH
+        self.options = {}
+        if skill_level is not None:
+            self.options["Skill Level"] = skill_level
+        if elo is not None:
+            self.options.update({"UCI_LimitStrength": True, "UCI_Elo": elo})
+        self.limit = chess.engine.Limit(time=None if depth or nodes else time, depth=depth, nodes=nodes)
+        self.engines = engines
+        self._engine = None
+        self._pool = None
+        self._pool_lock = None
+
+    def get_move(self, board: chess.Board, **request_options) -> str:
+        if self._engine is None:
+            self._engine = chess.engine.SimpleEngine.popen_uci(self.path)
+            self._engine.configure(self.options)
+        return self._engine.play(board, self.limit).move.uci()
+
+    async def async_get_move(self, board: chess.Board, **request_options) -> str:
+        if self._pool_lock is None:
+            self._pool_lock = asyncio.Lock()
+        async with self._pool_lock:
+            if self._pool is None:
+                pool = EnginePool(self.engines, self.path, options=self.options)
+                await pool.start()
+                self._pool = pool
+        async with self._pool.lease() as protocol:
+            result = await protocol.play(board, self.limit)
+        return result.move.uci()
+
+    def close(self):
+        if self._engine is not None:
+            self._engine.quit()
+            self._engine = None
+
+    async def aclose(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+            self._pool_lock = None
+
+@register_provider("random")
+class RandomMoveProvider(MoveProvider):
+    # A uniformly random legal move: a floor for comparisons, and a way to
+    # exercise the harness at full speed.
+    def __init__(self, seed: int = None):
+        self.random = random.Random(seed)
+
+    def get_move(self, board: chess.Board, **request_options) -> str:
+        return self.random.choice(sorted(board.legal_moves, key=chess.Move.uci)).uci()
+
+def parse_provider_options(pairs: list) -> dict:
+    # ["skill_level=5", "time=0.1"] -> {"skill_level": 5, "time": 0.1}
+    options = {}
+    for pair in pairs or ():
+        key, _, value = pair.partition("=")
+        for convert in (int, float):
+            try:
+                value = convert(value)
+                break
+            except ValueError:
+                pass
+        options[key.strip().replace("-", "_")] = value
+    return options
+
+def get_ai_move(board: chess.Board, **request_options) -> str:
+    return (move_provider or _default_provider).get_move(board, **request_options)
+
+async def async_get_ai_move(board: chess.Board, **request_options) -> str:
+    return await (move_provider or _default_provider).async_get_move(board, **request_options)
+
+def close_move_provider():
+    if move_provider:
+        move_provider.close()
+
+_default_provider = OpenAIChatProvider()
+
+def process_ai_move(board: chess.Board, move_str: str, last_attempt: bool = True):
+    # Plays the first legal move in the answer, written in UCI, SAN or long
+    # algebraic notation and possibly inside prose (see extract_move).
+    outcome = "AI loses by default." if last_attempt else "Asking again."
+    move, form = extract_move(board, move_str)
+    if move is None and not (MOVE_TOKEN_RE.search(move_str) or move_str.strip() == "0000"):
+        print(f"ERROR: The move format '{move_str}' is invalid. {outcome}")
         print(f"Attempted move: {move_str}")
         return  None, move_str
 
-    if move not in board.legal_moves:
-        print(f"ERROR: The move '{move_str}' is illegal in the current position. AI loses by default.")
+    if move is None:
+        print(f"ERROR: The move '{move_str}' is illegal in the current position ({move_rejection(board, move_str)}). "
+              f"{outcome}")
         print(f"Attempted move: {move_str}")
         return  None, move_str
 
+    answer_stats.record_form(form)
+    if move_str.strip() != move.uci():
+        print(f"Read {form} answer '{move_str}' as {move.uci()}")
     board.push(move)
     return move, move_str
 
-def simulate_game():
+def move_rejection(board: chess.Board, move_str: str):
+    # Why the answer has no legal move in board (for the model), or None.
+    if extract_move(board, move_str)[0] is not None:
+        return None
+    uci = move_str.strip()
+    match = MOVE_TOKEN_RE.search(move_str)
+    if match and match.group("lan"):
+        # Explain the first UCI-looking move of a longer answer.
+        uci = match.group("lan").replace("-", "").replace("x", "") + (match.group("lan_promotion") or "").lower()
+    try:
+        move = chess.Move.from_uci(uci)
+    except ValueError:
+        if match:
+            return f"{match.group(0)} is not a legal move"
+        return f"'{move_str}' contains no move in UCI or SAN notation"
+    if not move:
+        return "passing (a null move) is not allowed"
+    from_name, to_name = chess.square_name(move.from_square), chess.square_name(move.to_square)
+    piece = board.piece_at(move.from_square)
+    side = "White" if board.turn == chess.WHITE else "Black"
+    if piece is None:
+        return f"there is no piece on {from_name}"
+    if piece.color != board.turn:
+        return f"the piece on {from_name} is not {side}'s"
+    if board.is_pseudo_legal(move):
+        return f"{uci} would leave {side}'s king in check"
+    if piece.piece_type == chess.PAWN and chess.square_rank(move.to_square) in (0, 7) and not move.promotion:
+        return "a pawn reaching the last rank must promote (add q, r, b or n)"
+    return f"the {chess.piece_name(piece.piece_type)} on {from_name} cannot move to {to_name}"
+
+def _take_ai_answer(board: chess.Board, ai_move_str: str, ai_move_number: int, attempt: int, last_attempt: bool,
+                    feedback: list, move_log=None):
+    # Prints and checks one answer. A rejected answer is added to feedback
+    # and logged (with the journal's move records when those are on).
+    label = f"GPT (Black) move {ai_move_number}" + (f", attempt {attempt + 1}" if attempt else "")
+    print(f"{label}: {ai_move_str}")
+    move, _ = process_ai_move(board, ai_move_str, last_attempt)
+    if move is None:
+        reason = move_rejection(board, ai_move_str)
+        feedback.append((ai_move_str, reason))
+        if move_log:
+            move_log(board, rejected=ai_move_str, reason=reason)
+    return move
+
+def play_ai_move(board: chess.Board, ai_move_number: int, move_retries: int = 0, move_log=None,
+                 **request_options):
+    # Asks for GPT's move and plays it. A rejected answer goes back to the
+    # model with the reason, up to move_retries times. Returns the move, or
+    # None if every attempt was rejected; raises LLMUnavailableError.
+    feedback = []
+    mode = request_options.get("response_format", "text")
+    for attempt in range(move_retries + 1):
+        answer_start = time.perf_counter()
+        ai_move_str = get_ai_move(board, feedback=list(feedback), **request_options)
+        answer_time = time.perf_counter() - answer_start
+        move = _take_ai_answer(board, ai_move_str, ai_move_number, attempt, attempt == move_retries, feedback,
+                               move_log)
+        answer_stats.record(mode, answer_time, move is not None)
+        if move is not None:
+            break
+    answer_stats.record_attempts(attempt + 1, move is not None)
+    return move
+
+async def async_play_ai_move(board: chess.Board, ai_move_number: int, move_retries: int = 0, move_log=None,
+                             **request_options):
+    feedback = []
+    mode = request_options.get("response_format", "text")
+    for attempt in range(move_retries + 1):
+        answer_start = time.perf_counter()
+        ai_move_str = await async_get_ai_move(board, feedback=list(feedback), **request_options)
+        answer_time = time.perf_counter() - answer_start
+        move = _take_ai_answer(board, ai_move_str, ai_move_number, attempt, attempt == move_retries, feedback,
+                               move_log)
+        answer_stats.record(mode, answer_time, move is not None)
+        if move is not None:
+            break
+    answer_stats.record_attempts(attempt + 1, move is not None)
+    return move
+
+def _white_search_info(eval_depth):
+    # Unless a separate fixed-depth analysis is requested, White's own search
+    # doubles as the evaluation of the position GPT just left.
+    if eval_depth is None:
+        return chess.engine.INFO_SCORE | chess.engine.INFO_PV
+    return chess.engine.INFO_NONE
+
+def _print_evaluation(info: dict):
+    score = info["score"].white().score(mate_score=10000)
+    print(f"Stockfish evaluation after GPT move: {score} centipawns\n")
+
+def _record_ponder(ponder_stats: dict, hit: bool, search_time: float, limit: chess.engine.Limit):
+    # On a ponder hit the engine keeps the search it started while GPT was
+    # thinking, so the move arrives after whatever is left of the time limit
+    # (often nothing). The time saved is the part of the limit not spent
+    # after GPT replied.
+    if hit:
+        ponder_stats["hits"] += 1
+        ponder_stats["time_saved"] += max(0.0, limit.time - search_time)
+        print(f"Ponder hit: White replied after {search_time:.2f}s")
+    else:
+        ponder_stats["misses"] += 1
+
+def _print_ponder_stats(ponder_stats: dict):
+    searches = ponder_stats["hits"] + ponder_stats["misses"]
+    hit_rate = ponder_stats["hits"] / searches if searches else 0.0
+    print(f"Ponder: {ponder_stats['hits']}/{searches} hits ({hit_rate:.0%}), "
+          f"engine time saved: {ponder_stats['time_saved']:.1f}s")
+
+def _start_board(opening: str = None) -> chess.Board:
+    # Openings are space-separated UCI moves played before GPT's first turn.
     board = chess.Board()
+    for uci in (opening or "").split():
+        board.push_uci(uci)
+    return board
+
+def simulate_game(eval_depth: int = None, ponder: bool = False, opening: str = None, model: str = "gpt-4o",
+                  seed: int = None, white_time: float = None, response_format: str = "text", move_retries: int = 0,
+                  list_legal_moves: bool = False, prompt_layout: str = "inline", conversation: str = None,
+                  context_budget: int = 2048, move_log=None):
+    # move_log, if given, is called with the board after every move, and
+    # with rejected=/reason= for every rejected GPT answer. conversation
+    # ("window" or "summary") plays the game as one chat; see Conversation.
+    board = _start_board(opening)
+    chat = Conversation(conversation, context_budget) if conversation else None
+    white_limit = chess.engine.Limit(time=white_time) if white_time else WHITE_LIMIT
     failed_move_number = None
     ai_move_number = 0  # Counts the number of moves GPT (Black) makes
+    engine_restarts = 0
+    # python-chess only sends ponderhit within the same game, and starts a new
+    # game in the engine whenever this token changes.
+    game_token = object()
+    ponder_move = None  # Black reply Stockfish is pondering on
+    ponder_stats = {"hits": 0, "misses": 0, "time_saved": 0.0}
 
     # Continue until game over
     while not board.is_game_over():
         if board.turn == chess.WHITE:
             # White's move from Stockfish engine
             try:
-                result = engine.play(board, chess.engine.Limit(time=2.0))
+                search_start = time.perf_counter()
+                result = engine.play(board, white_limit, info=_white_search_info(eval_depth),
+                                     ponder=ponder, game=game_token)
+                if ponder_move is not None:
+                    _record_ponder(ponder_stats, board.peek() == ponder_move, time.perf_counter() - search_start,
+                                   white_limit)
+                ponder_move = result.ponder if ponder else None
+                if ai_move_number and "score" in result.info:
+                    _print_evaluation(result.info)
                 board.push(result.move)
+                if move_log:
+                    move_log(board)
+            except chess.engine.EngineTerminatedError as e:
+                if engine_restarts >= 3:
+                    print(f"Error in engine move: {e}")
+                    break
+                print(f"Stockfish terminated ({e}); restarting it")
+                engine_restarts += 1
+                ponder_move = None
+                restart_engine()
             except Exception as e:
                 print(f"Error in engine move: {e}")
                 break
         else:
             # GPT's move as Black
             ai_move_number += 1
-            ai_move_str = get_ai_move(board)
-            print(f"GPT (Black) move {ai_move_number}: {ai_move_str}")
-            move, attempted_move = process_ai_move(board, ai_move_str)
+            try:
+                move = play_ai_move(board, ai_move_number, move_retries, move_log, model=model, seed=seed,
+                                    response_format=response_format, list_legal_moves=list_legal_moves,
+                                    prompt_layout=prompt_layout, conversation=chat)
+            except LLMUnavailableError as e:
+                print(f"OpenAI API unavailable on move {ai_move_number}: {e}")
+                break
             if move is None:
                 failed_move_number = ai_move_number
                 break
-            print(f"GPT plays: {attempted_move}")
+            print(f"GPT plays: {move.uci()}")
+            if move_log:
+                move_log(board)
 
-            # Optional: evaluate position after GPT move using Stockfish
-            if engine:
+            # Optional: separate fixed-depth evaluation after GPT move, for
+            # numbers that are comparable across time controls and machines
+            if engine and eval_depth is not None:
                 try:
-                    info = engine.analyse(board, chess.engine.Limit(time=0.5))
-                    score = info["score"].white().score(mate_score=10000)
-                    print(f"Stockfish evaluation after GPT move: {score} centipawns\n")
+                    info = engine.analyse(board, chess.engine.Limit(depth=eval_depth), game=game_token)
+                    _print_evaluation(info)
                 except Exception as e:
                     print(f"Error during engine analysis: {e}\n")
 
+    if ponder:
+        _print_ponder_stats(ponder_stats)
+
     # Determine game result.
     # If GPT made an invalid move, we force the result to be a loss ("1-0").
+    # A game cut short by the API or the engine stays unfinished ("*").
     result = board.result()
     if failed_move_number is not None:
         result = "1-0"
@@ -112,25 +2553,399 @@ def simulate_game():
         print("Result: White wins (GPT loses).")
     elif result == "0-1":
         print("Result: GPT wins!")
+    elif result == "*":
+        print("Result: Abandoned (infrastructure failure).")
     else:
         print("Result: Draw!")
 
     return result, failed_move_number, board
 
-def simulate_games(num_games: int):
+async def async_simulate_game(engine_pool: EnginePool, lease_per_move: bool = False, eval_depth: int = None,
+                              ponder: bool = False, opening: str = None, model: str = "gpt-4o", seed: int = None,
+                              white_time: float = None, response_format: str = "text", move_retries: int = 0,
+                              list_legal_moves: bool = False, prompt_layout: str = "inline", conversation: str = None,
+                              context_budget: int = 2048, move_log=None):
+    # Same game as simulate_game, but on the asyncio engine protocol and the
+    # async OpenAI client, so other games can run while this one waits.
+    # Engines come from the shared pool, either held for the whole game or
+    # leased separately for every search. Pondering needs the same engine
+    # between moves, so it only applies to per-game leases.
+    board = _start_board(opening)
+    chat = Conversation(conversation, context_budget) if conversation else None
+    white_limit = chess.engine.Limit(time=white_time) if white_time else WHITE_LIMIT
+    failed_move_number = None
+    ai_move_number = 0  # Counts the number of moves GPT (Black) makes
+
+    engine_restarts = 0
+    game_token = object()
+    ponder = ponder and not lease_per_move
+    ponder_move = None
+    ponder_stats = {"hits": 0, "misses": 0, "time_saved": 0.0}
+    try:
+        game_engine = None if lease_per_move else await engine_pool.acquire()
+    except Exception as e:
+        # No engine could be started for this game: abandon it, not the run.
+        print(f"Error starting Stockfish: {e}")
+        print("Result: Abandoned (infrastructure failure).")
+        return "*", None, board
+
+    def engine_lease():
+        return contextlib.nullcontext(game_engine) if game_engine else engine_pool.lease()
+
+    try:
+        while not board.is_game_over():
+            if board.turn == chess.WHITE:
+                try:
+                    search_start = time.perf_counter()
+                    async with engine_lease() as engine_protocol:
+                        result = await engine_protocol.play(board, white_limit, info=_white_search_info(eval_depth),
+                                                            ponder=ponder, game=game_token)
+                    if ponder_move is not None:
+                        _record_ponder(ponder_stats, board.peek() == ponder_move,
+                                       time.perf_counter() - search_start, white_limit)
+                    ponder_move = result.ponder if ponder else None
+                    if ai_move_number and "score" in result.info:
+                        _print_evaluation(result.info)
+                    board.push(result.move)
+                    if move_log:
+                        move_log(board)
+                except chess.engine.EngineTerminatedError as e:
+                    # Per-move leases are replaced by the pool on return; a
+                    # per-game engine is swapped in place.
+                    if engine_restarts >= 3:
+                        print(f"Error in engine move: {e}")
+                        break
+                    print(f"Stockfish terminated ({e}); restarting it")
+                    engine_restarts += 1
+                    ponder_move = None
+                    if game_engine:
+                        try:
+                            game_engine = await engine_pool.replace(game_engine)
+                        except Exception as restart_error:
+                            # The game is abandoned ("*"); the pool shrinks.
+                            print(f"Error restarting Stockfish: {restart_error}")
+                            engine_pool.discard(game_engine)
+                            game_engine = None
+                            break
+                except Exception as e:
+                    print(f"Error in engine move: {e}")
+                    break
+            else:
+                ai_move_number += 1
+                try:
+                    move = await async_play_ai_move(board, ai_move_number, move_retries, move_log, model=model,
+                                                    seed=seed, response_format=response_format,
+                                                    list_legal_moves=list_legal_moves,
+                                                    prompt_layout=prompt_layout, conversation=chat)
+                except LLMUnavailableError as e:
+                    print(f"OpenAI API unavailable on move {ai_move_number}: {e}")
+                    break
+                if move is None:
+                    failed_move_number = ai_move_number
+                    break
+                print(f"GPT plays: {move.uci()}")
+                if move_log:
+                    move_log(board)
+
+                if eval_depth is not None:
+                    try:
+                        async with engine_lease() as engine_protocol:
+                            info = await engine_protocol.analyse(board, chess.engine.Limit(depth=eval_depth),
+                                                                 game=game_token)
+                        _print_evaluation(info)
+                    except Exception as e:
+                        print(f"Error during engine analysis: {e}\n")
+    finally:
+        if game_engine:
+            await engine_pool.release(game_engine)
+
+    if ponder:
+        _print_ponder_stats(ponder_stats)
+
+    result = board.result()
+    if failed_move_number is not None:
+        result = "1-0"
+    if result == "1-0":
+        print("Result: White wins (GPT loses).")
+    elif result == "0-1":
+        print("Result: GPT wins!")
+    elif result == "*":
+        print("Result: Abandoned (infrastructure failure).")
+    else:
+        print("Result: Draw!")
+
+    return result, failed_move_number, board
+
+def _take_worker_stats():
+    # Hands the answer stats and LLM telemetry gathered since the last game
+    # to the parent, which merges them into its own for the final report.
+    global answer_stats
+    stats = answer_stats, llm_telemetry.models
+    answer_stats = AnswerStats()
+    llm_telemetry.models = {}
+    return stats
+
+def _merge_worker_stats(stats):
+    worker_answers, worker_models = stats
+    answer_stats.merge(worker_answers)
+    llm_telemetry.merge(worker_models)
+
+def _print_worker_stats():
+    # Pool workers hand their answer stats and LLM telemetry to the parent
+    # after every game, so these are empty there; job workers report here.
+    answer_stats.print_stats(f"Worker {os.getpid()} GPT answers")
+    llm_telemetry.print_stats(f"Worker {os.getpid()} LLM telemetry")
+    if stream_stats:
+        stream_stats.print_stats(f"Worker {os.getpid()} streaming")
+    if hedger:
+        hedger.print_stats(f"Worker {os.getpid()} hedged requests")
+    if voter:
+        voter.print_stats(f"Worker {os.getpid()} self-consistency voting")
+    conversation_stats.print_stats(f"Worker {os.getpid()} conversation")
+    if retry_policy:
+        retry_policy.print_stats(f"Worker {os.getpid()} API retries")
+    if http_stats:
+        http_stats.print_stats(f"Worker {os.getpid()} HTTP")
+
+def _init_worker(llm_settings: dict = None, cassette_settings: dict = None, pool_worker: bool = False):
+    # Runs once in every pool process. Forked workers inherit the parent's
+    # engine and client objects, but the engine's I/O thread does not survive
+    # the fork, so each worker starts its own Stockfish and OpenAI client
+    # (configure_llm builds the client and its connection pool). Spawned
+    # workers start without an engine (see start_engine).
+    global engine
+    configure_llm(**(llm_settings or {}))
+    prewarm_connections()
+    if pool_worker:
+        # The parent prints the periodic telemetry from the merged stats.
+        llm_telemetry.interval = 0.0
+    multiprocessing.util.Finalize(None, _print_worker_stats, exitpriority=5)
+    multiprocessing.util.Finalize(None, close_move_provider, exitpriority=10)
+    if llm_cache:
+        multiprocessing.util.Finalize(None, llm_cache.flush, exitpriority=10)
+    engine = None
+    if (cassette_settings or {}).get("mode") != "replay":
+        try:
+            engine = chess.engine.SimpleEngine.popen_uci(STOCKFISH_PATH)
+        except Exception as e:
+            print(f"Error starting Stockfish in worker {os.getpid()}: {e}")
+        else:
+            # Quit the engine before the worker joins its threads on exit,
+            # otherwise the engine's I/O thread keeps the worker (and the pool
+            # shutdown) alive.
+            multiprocessing.util.Finalize(None, _quit_engine, exitpriority=10)
+    configure_cassette(**(cassette_settings or {}))
+
+# Tournament journal: an append-only JSON-lines file with one record per
+# finished game (and optionally one per move). Resuming a run replays the game
+# records into the tally and plays only the games that are missing; a game
+# that was interrupted part-way is replayed from the start.
+def _append_journal(journal: str, record: dict):
+    with open(journal, "a") as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def _journal_move(journal: str, game_number: int, board: chess.Board, rejected: str = None, reason: str = None):
+    if rejected is not None:
+        # A rejected GPT answer for the next ply; resuming ignores these.
+        _append_journal(journal, {"type": "rejected", "game": game_number, "ply": len(board.move_stack) + 1,
+                                  "answer": rejected, "reason": reason})
+        return
+    _append_journal(journal, {"type": "move", "game": game_number, "ply": len(board.move_stack),
+                              "move": board.peek().uci()})
+
+def _journal_game(journal: str, game):
+    game_number, result, failed_move_number, board = game
+    _append_journal(journal, {"type": "game", "game": game_number, "result": result,
+                              "failed_move_number": failed_move_number,
+                              "moves": " ".join(move.uci() for move in board.move_stack)})
+
+def load_journal(journal: str) -> dict:
+    # Returns the finished games in the journal, keyed by game number.
+    finished = {}
+    with open(journal) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Torn final write from a crash
+            if record.get("type") == "game":
+                finished[record["game"]] = record
+    return finished
+
+def _open_journal(journal: str, resume: bool) -> dict:
+    if resume:
+        finished = {}
+        if os.path.exists(journal):
+            finished = load_journal(journal)
+            # Terminate a torn final line so the next record starts cleanly.
+            with open(journal, "rb+") as f:
+                size = f.seek(0, os.SEEK_END)
+                if size:
+                    f.seek(size - 1)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+        print(f"Resuming from {journal}: {len(finished)} finished game(s)")
+        return finished
+    if os.path.exists(journal) and os.path.getsize(journal) > 0:
+        raise FileExistsError(f"Journal {journal} already exists; resume it or choose another path")
+    return {}
+
+def _replay_journal(finished: dict):
+    for game_number in sorted(finished):
+        record = finished[game_number]
+        yield game_number, record["result"], record["failed_move_number"], _start_board(record["moves"])
+
+def _journal_games(games, journal: str):
+    for game in games:
+        _journal_game(journal, game)
+        yield game
+
+def _move_logger(move_journal: str, game_number: int):
+    # A partial rather than a closure so it can be sent to pool workers.
+    return functools.partial(_journal_move, move_journal, game_number) if move_journal else None
+
+def _play_game_in_worker(game_number: int, game_options: dict, move_journal: str = None):
+    print(f"\n=== Starting Game {game_number} (worker {os.getpid()}) ===")
+    result, failed_move_number, board = simulate_game(move_log=_move_logger(move_journal, game_number),
+                                                      **game_options)
+    return game_number, result, failed_move_number, board, _take_worker_stats()
+
+def _run_games_serial(game_numbers: list, game_options: dict, move_journal: str = None):
+    prewarm_connections()
+    for game_number in game_numbers:
+        print(f"\n=== Starting Game {game_number} ===")
+        result, failed_move_number, board = simulate_game(move_log=_move_logger(move_journal, game_number),
+                                                          **game_options)
+        yield game_number, result, failed_move_number, board
+
+def _run_games_parallel(game_numbers: list, workers: int, game_options: dict, move_journal: str = None):
+    # Games are independent, so they are fanned out one per task and results
+    # are merged in the parent as they complete.
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(_llm_settings, _cassette_settings, True)) as pool:
+        futures = [pool.submit(_play_game_in_worker, game_number, game_options, move_journal)
+                   for game_number in game_numbers]
+        for future in as_completed(futures):
+            *game, stats = future.result()
+            _merge_worker_stats(stats)
+            llm_telemetry.report_if_due()
+            yield tuple(game)
+
+async def _async_play_game(game_number: int, semaphore: asyncio.Semaphore, engine_pool: EnginePool,
+                           lease_per_move: bool, game_options: dict):
+    async with semaphore:
+        print(f"\n=== Starting Game {game_number} ===")
+        result, failed_move_number, board = await async_simulate_game(engine_pool, lease_per_move, **game_options)
+        return game_number, result, failed_move_number, board
+
+async def async_simulate_games(num_games: int, max_concurrent: int = 100, engines: int = 0,
+                               lease_per_move: bool = False, coalesce: bool = False, batch_window: float = 0.0,
+                               adaptive_llm_concurrency: int = 0, journal: str = None, resume: bool = False,
+                               journal_moves: bool = False, **game_options):
+    global request_broker, rate_controller
+    finished = _open_journal(journal, resume) if journal else {}
+    game_numbers = [n for n in range(1, num_games + 1) if n not in finished]
+    # The UCI protocol handles one search at a time, so games share a fixed
+    # budget of engines; by default there is one per concurrent game.
+    engine_pool = EnginePool(engines or max(1, min(max_concurrent, len(game_numbers))))
+    await engine_pool.start()
+    if coalesce:
+        request_broker = RequestBroker(window=batch_window)
+    if adaptive_llm_concurrency:
+        rate_controller = AdaptiveConcurrency(max_limit=adaptive_llm_concurrency)
+    cache_counters = llm_cache.counters() if llm_cache else None
+    await async_prewarm_connections()
+    start_time = time.perf_counter()
+    try:
+        semaphore = asyncio.Semaphore(max_concurrent)
+        move_journal = journal if journal_moves else None
+        tasks = [asyncio.create_task(_async_play_game(game_number, semaphore, engine_pool, lease_per_move,
+                                                      dict(game_options,
+                                                           move_log=_move_logger(move_journal, game_number))))
+                 for game_number in game_numbers]
+        games = list(_replay_journal(finished))
+        for task in asyncio.as_completed(tasks):
+            game = await task
+            if journal:
+                _journal_game(journal, game)
+            games.append(game)
+        _tally_games(games, num_games, start_time, f"up to {max_concurrent} concurrent game(s)")
+        engine_pool.print_stats()
+        if request_broker:
+            request_broker.print_stats()
+        if rate_controller:
+            rate_controller.print_stats()
+        if llm_cache:
+            llm_cache.print_stats(since=cache_counters)
+        answer_stats.print_stats()
+        llm_telemetry.print_stats()
+        if stream_stats:
+            stream_stats.print_stats()
+        if hedger:
+            hedger.print_stats()
+        if voter:
+            voter.print_stats()
+        conversation_stats.print_stats()
+        if retry_policy:
+            retry_policy.print_stats()
+        if http_stats:
+            http_stats.print_stats()
+    finally:
+        request_broker = None
+        rate_controller = None
+        await engine_pool.close()
+        if move_provider:
+            await move_provider.aclose()
+
+def simulate_games(num_games: int, workers: int = 1, journal: str = None, resume: bool = False,
+                   journal_moves: bool = False, **game_options):
+    # game_options are passed through to simulate_game.
+    start_time = time.perf_counter()
+    cache_counters = llm_cache.counters() if llm_cache else None
+    finished = _open_journal(journal, resume) if journal else {}
+    game_numbers = [n for n in range(1, num_games + 1) if n not in finished]
+    move_journal = journal if journal_moves else None
+    if workers > 1:
+        games = _run_games_parallel(game_numbers, workers, game_options, move_journal)
+    else:
+        games = _run_games_serial(game_numbers, game_options, move_journal)
+    if journal:
+        games = itertools.chain(_replay_journal(finished), _journal_games(games, journal))
+    _tally_games(games, num_games, start_time, f"{workers} worker(s)")
+    if llm_cache:
+        llm_cache.print_stats(since=cache_counters)
+    answer_stats.print_stats()
+    llm_telemetry.print_stats()
+    if workers <= 1:
+        if stream_stats:
+            stream_stats.print_stats()
+        if hedger:
+            hedger.print_stats()
+        if voter:
+            voter.print_stats()
+        conversation_stats.print_stats()
+        if retry_policy:
+            retry_policy.print_stats()
+        if http_stats:
+            http_stats.print_stats()
+
+def _tally_games(games, num_games: int, start_time: float, mode: str, elapsed: float = None):
+    # `elapsed` overrides the wall time since start_time, for results that
+    # were played elsewhere (report_jobs).
     wins = 0
     losses = 0
     draws = 0
     invalid_moves = 0
+    abandoned = 0  # infrastructure failures, not scored
 
     # Dictionary to accumulate invalid move numbers and their frequency.
     invalid_move_distribution = {}
 
-    for i in range(num_games):
-        print(f"\n=== Starting Game {i+1} ===")
-        result, failed_move_number, board = simulate_game()
+    for game_number, result, failed_move_number, board in games:
         print(board)
-        print(f"Game {i+1} result: {result}")
+        print(f"Game {game_number} result: {result}")
 
         if failed_move_number is not None:
             print(f"GPT made an invalid move on move number {failed_move_number}")
@@ -141,21 +2956,576 @@ def simulate_games(num_games: int):
             wins += 1
         elif result == "1-0":  # GPT loses
             losses += 1
+        elif result == "*":  # API or engine failure
+            abandoned += 1
         else:
             draws += 1
 
+    if elapsed is None:
+        elapsed = time.perf_counter() - start_time
 
     print("\n=== Simulation Complete ===")
     print(f"Total games: {num_games}")
     print(f"Wins: {wins}, Losses: {losses}, Draws: {draws}, Invalid moves: {invalid_moves}")
+    if abandoned:
+        print(f"Abandoned (infrastructure failures): {abandoned}")
+    print(f"Elapsed: {elapsed:.1f}s with {mode} ({num_games / max(elapsed, 1e-9) * 3600:.0f} games/hour)")
     print("\nInvalid move distribution (move number : count):")
     for move_number in sorted(invalid_move_distribution.keys()):
         print(f"  {move_number}: {invalid_move_distribution[move_number]}")
 
+# Distributed runs: a coordinator writes one job per game into a SQLite table
+# on shared storage, and workers on any host claim jobs, heartbeat while they
+# play and write the result back. Jobs whose worker stops heartbeating for
+# longer than the lease timeout go back to the queue.
+JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    seed INTEGER,
+    opening TEXT,
+    model TEXT NOT NULL,
+    white_time REAL,
+    status TEXT NOT NULL DEFAULT 'queued',  -- queued, running or done
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    heartbeat REAL,
+    result TEXT,
+    failed_move_number INTEGER,
+    final_fen TEXT,
+    created_at REAL,
+    started_at REAL,
+    finished_at REAL
+)
+"""
+
+def _open_jobs_db(db_path: str) -> sqlite3.Connection:
+    # Autocommit mode with explicit transactions. The default rollback journal
+    # is kept because WAL mode does not work on network file systems.
+    conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    conn.execute(JOBS_SCHEMA)
+    return conn
+
+def read_openings(path: str) -> list:
+    # One opening per line as space-separated UCI moves; blank lines and
+    # lines starting with '#' are skipped.
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+def enqueue_jobs(db_path: str, num_games: int, model: str = "gpt-4o", white_time: float = None,
+                 openings: list = None, seed: int = 0):
+    openings = openings or [None]
+    conn = _open_jobs_db(db_path)
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    conn.executemany(
+        "INSERT INTO jobs (seed, opening, model, white_time, created_at) VALUES (?, ?, ?, ?, ?)",
+        [(seed + i, openings[i % len(openings)], model, white_time, now) for i in range(num_games)])
+    conn.execute("COMMIT")
+    conn.close()
+    print(f"Queued {num_games} job(s) in {db_path}")
+
+def _claim_job(conn: sqlite3.Connection, worker_id: str, lease_timeout: float, max_attempts: int = 3):
+    now = time.time()
+    # BEGIN IMMEDIATE takes the write lock up front, so two workers can never
+    # select the same queued job. A job whose worker stopped heartbeating is
+    # queued again, or abandoned ("*") once it has used max_attempts claims.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        failed = conn.execute(
+            "UPDATE jobs SET status = 'done', result = '*', worker = NULL, finished_at = ? "
+            "WHERE status = 'running' AND heartbeat < ? AND attempts >= ?",
+            (now, now - lease_timeout, max_attempts)).rowcount
+        requeued = conn.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' AND heartbeat < ?",
+            (now - lease_timeout,)).rowcount
+        job = conn.execute(
+            "SELECT id, seed, opening, model, white_time FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+        ).fetchone()
+        if job:
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, heartbeat = ?, started_at = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (worker_id, now, now, job[0]))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if requeued:
+        print(f"Requeued {requeued} job(s) from workers that stopped heartbeating")
+    if failed:
+        print(f"Abandoned {failed} job(s) that lost their worker {max_attempts} time(s)")
+    return job
+
+def _heartbeat_job(db_path: str, job_id: int, worker_id: str, interval: float, stop: threading.Event):
+    conn = _open_jobs_db(db_path)
+    while not stop.wait(interval):
+        try:
+            conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ?", (time.time(), job_id, worker_id))
+        except sqlite3.Error as e:
+            print(f"Error sending heartbeat for job {job_id}: {e}")
+    conn.close()
+
+def run_job_worker(db_path: str, lease_timeout: float = 120.0, max_attempts: int = 3, **game_options):
+    # Plays jobs until none are queued and none are running elsewhere (a
+    # running job may still come back if its worker dies). A game abandoned
+    # for infrastructure reasons ("*", e.g. an API outage) is queued again
+    # until the job has been tried max_attempts times.
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    conn = _open_jobs_db(db_path)
+    while True:
+        job = _claim_job(conn, worker_id, lease_timeout, max_attempts)
+        if job is None:
+            running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+            if not running:
+                break
+            time.sleep(min(lease_timeout / 4, 10.0))
+            continue
+
+        job_id, seed, opening, model, white_time = job
+        print(f"\n=== Starting job {job_id} ({worker_id}) ===")
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat_job, args=(db_path, job_id, worker_id, lease_timeout / 4, stop),
+                                     daemon=True)
+        heartbeat.start()
+        try:
+            result, failed_move_number, board = simulate_game(opening=opening, model=model, seed=seed,
+                                                              white_time=white_time, **game_options)
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        if result == "*" and conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL "
+                "WHERE id = ? AND worker = ? AND status = 'running' AND attempts < ?",
+                (job_id, worker_id, max_attempts)).rowcount:
+            print(f"Job {job_id} abandoned; requeued")
+            continue
+        updated = conn.execute(
+            "UPDATE jobs SET status = 'done', result = ?, failed_move_number = ?, final_fen = ?, finished_at = ? "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (result, failed_move_number, board.fen(), time.time(), job_id, worker_id)).rowcount
+        if updated:
+            print(f"Job {job_id} result: {result}")
+        else:
+            print(f"Job {job_id} was requeued while this worker played it; result discarded")
+    conn.close()
+
+def _job_worker_process(db_path: str, lease_timeout: float, max_attempts: int, llm_settings: dict,
+                        cassette_settings: dict, game_options: dict):
+    _init_worker(llm_settings, cassette_settings)
+    run_job_worker(db_path, lease_timeout, max_attempts, **game_options)
+
+def run_job_workers(db_path: str, workers: int = 1, lease_timeout: float = 120.0, max_attempts: int = 3,
+                    **game_options):
+    if workers <= 1:
+        prewarm_connections()
+        run_job_worker(db_path, lease_timeout, max_attempts, **game_options)
+        return
+    processes = [multiprocessing.Process(target=_job_worker_process,
+                                         args=(db_path, lease_timeout, max_attempts, _llm_settings,
+                                               _cassette_settings, game_options))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+def report_jobs(db_path: str):
+    conn = _open_jobs_db(db_path)
+    counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+    print(f"Jobs: {counts.get('done', 0)} done, {counts.get('running', 0)} running, {counts.get('queued', 0)} queued")
+    rows = conn.execute(
+        "SELECT id, result, failed_move_number, final_fen FROM jobs WHERE status = 'done' ORDER BY id").fetchall()
+    span = conn.execute("SELECT MAX(finished_at) - MIN(started_at) FROM jobs WHERE status = 'done'").fetchone()[0]
+    conn.close()
+    # Jobs given up after max_attempts lost leases have no final position.
+    games = ((job_id, result, failed_move_number, chess.Board(fen or chess.STARTING_FEN)) for job_id, result, failed_move_number, fen in rows)
+    # Elapsed is the wall time between the first claim and the last result.
+    _tally_games(games, len(rows), None, "job table workers", elapsed=span or 0.0)
+
+# Offline evaluation through the Batch API (half the price of synchronous
+# calls, with a separate and much larger rate limit). Every position of a
+# file becomes one request line, the lines are uploaded in shards within the
+# API's limits, and the answers are joined back to the positions once the
+# batches finish. Files are streamed end to end and the join goes through a
+# temporary SQLite table, so memory use does not grow with the number of
+# positions. The batch directory keeps a manifest of shards and batch ids, so
+# an interrupted run picks up its batches instead of submitting them again.
+BATCH_MAX_REQUESTS = 50000  # per batch (API limit)
+BATCH_MAX_BYTES = 190 * 2 ** 20  # per input file; the API takes up to 200 MB
+BATCH_DONE = ("completed", "failed", "expired", "cancelled")
+
+def read_positions(path: str):
+    # Yields (line number, FEN) for each position in path, one FEN per line;
+    # blank lines and lines starting with '#' are skipped. The line number is
+    # the position's custom_id in the batch files.
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line_number, line
+
+def _position_board(fen: str):
+    try:
+        return chess.Board(fen)
+    except ValueError:
+        return None
+
+def write_batch_files(positions_path: str, batch_dir: str, max_requests: int = BATCH_MAX_REQUESTS,
+                      **request_options) -> list:
+    # Writes one /v1/chat/completions request per valid position, in shards
+    # of at most max_requests lines and BATCH_MAX_BYTES bytes. Returns the
+    # shard paths. request_options are passed to _move_request.
+    shards, out, count, size = [], None, 0, 0
+    try:
+        for line_number, fen in read_positions(positions_path):
+            board = _position_board(fen)
+            if board is None:
+                continue  # reported by join_batch_results
+            data = (json.dumps({"custom_id": f"line-{line_number}", "method": "POST", "url": "/v1/chat/completions",
+                                "body": _move_request(board, **request_options)}) + "\n").encode()
+            if out is None or count >= max_requests or size + len(data) > BATCH_MAX_BYTES:
+                if out:
+                    out.close()
+                shards.append(os.path.join(batch_dir, f"input-{len(shards) + 1:04d}.jsonl"))
+                out, count, size = open(shards[-1], "wb"), 0, 0
+            out.write(data)
+            count += 1
+            size += len(data)
+    finally:
+        if out:
+            out.close()
+    return shards
+
+def _save_manifest(batch_dir: str, manifest: dict):
+    path = os.path.join(batch_dir, "manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+def _submit_batch(path: str) -> str:
+    def upload():
+        # The open file is streamed by httpx rather than read into memory.
+        with open(path, "rb") as f:
+            return client.files.create(file=f, purpose="batch")
+    file = retry_policy.run(upload)
+    batch = retry_policy.run(lambda: client.batches.create(input_file_id=file.id, endpoint="/v1/chat/completions",
+                                                           completion_window="24h"))
+    return batch.id
+
+def _wait_for_batch(batch_id: str, poll_interval: float):
+    last = None
+    while True:
+        batch = retry_policy.run(lambda: client.batches.retrieve(batch_id))
+        counts = batch.request_counts
+        progress = (batch.status, counts.completed, counts.failed) if counts else (batch.status, 0, 0)
+        if progress != last:
+            total = counts.total if counts else 0
+            print(f"Batch {batch_id}: {batch.status} ({progress[1]}/{total} done, {progress[2]} failed)")
+            last = progress
+        if batch.status in BATCH_DONE:
+            for error in (batch.errors.data if batch.errors and batch.errors.data else []):
+                print(f"  Error on line {error.line}: {error.message}")
+            return batch
+        time.sleep(poll_interval)
+
+def _download_file(file_id: str, path: str):
+    def download():
+        with client.files.with_streaming_response.content(file_id) as response, open(path, "wb") as f:
+            for data in response.iter_bytes(1 << 16):
+                f.write(data)
+    retry_policy.run(download)
+
+def _batch_answers(result_paths: list, usage: dict):
+    # (line, HTTP status, content, error) for every record of the batch
+    # output and error files; adds up token usage as it goes.
+    for path in result_paths:
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                response = record.get("response") or {}
+                body = response.get("body") or {}
+                for key in usage:
+                    usage[key] += (body.get("usage") or {}).get(key, 0)
+                choices = body.get("choices") or []
+                error = record.get("error") or body.get("error")
+                yield (int(record["custom_id"].split("-", 1)[1]), response.get("status_code"),
+                       choices[0]["message"]["content"] if choices else None, json.dumps(error) if error else None)
+
+def join_batch_results(positions_path: str, result_paths: list, out_path: str, **request_options):
+    # Writes one JSON line per position to out_path, in the order of the
+    # positions file: its answer, whether the move is legal (and why not),
+    # or why there is no answer. Returns (status counts, token usage).
+    usage = dict(prompt_tokens=0, completion_tokens=0)
+    # An empty name gives a private temporary database that spills to disk.
+    conn = sqlite3.connect("")
+    conn.execute("CREATE TABLE answers (line INTEGER PRIMARY KEY, status INTEGER, content TEXT, error TEXT)")
+    conn.executemany("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?)", _batch_answers(result_paths, usage))
+    counts = dict.fromkeys(("legal", "illegal", "failed", "missing", "invalid_fen"), 0)
+    with open(out_path, "w") as out:
+        for line_number, fen in read_positions(positions_path):
+            result = {"line": line_number, "fen": fen}
+            board = _position_board(fen)
+            answer = conn.execute("SELECT status, content, error FROM answers WHERE line = ?",
+                                  (line_number,)).fetchone() if board else None
+            if board is None:
+                result["status"] = "invalid_fen"
+            elif answer is None:
+                result["status"] = "missing"
+            elif answer[0] != 200 or answer[1] is None:
+                result.update(status="failed", error=json.loads(answer[2]) if answer[2] else f"HTTP {answer[0]}")
+            else:
+                move_str = _answer_text(_move_request(board, **request_options), answer[1])
+                move, form = extract_move(board, move_str)
+                if move is None:
+                    result.update(move=move_str, status="illegal", reason=move_rejection(board, move_str))
+                else:
+                    result.update(move=move.uci(), status="legal", form=form)
+                    if move_str.strip() != move.uci():
+                        result["answer"] = move_str
+            counts[result["status"]] += 1
+            out.write(json.dumps(result) + "\n")
+    conn.close()
+    return counts, usage
+
+def run_batch(positions_path: str, batch_dir: str = None, max_requests: int = BATCH_MAX_REQUESTS,
+              poll_interval: float = 30.0, **request_options):
+    # Write, submit, wait, download and join. batch_dir defaults to
+    # POSITIONS.batch next to the positions file.
+    batch_dir = batch_dir or positions_path + ".batch"
+    os.makedirs(batch_dir, exist_ok=True)
+    manifest_path = os.path.join(batch_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        print(f"Resuming batch run in {batch_dir} ({len(manifest['shards'])} shard(s))")
+    else:
+        shards = write_batch_files(positions_path, batch_dir, max_requests, **request_options)
+        manifest = dict(positions=positions_path, request_options=request_options,
+                        shards=[{"input": path} for path in shards])
+        _save_manifest(batch_dir, manifest)
+        print(f"Wrote {len(shards)} batch input file(s) to {batch_dir}")
+
+    for shard in manifest["shards"]:
+        if not shard.get("batch_id"):
+            shard["batch_id"] = _submit_batch(shard["input"])
+            _save_manifest(batch_dir, manifest)
+            print(f"Submitted {shard['input']} as batch {shard['batch_id']}")
+    result_paths = []
+    for shard in manifest["shards"]:
+        if "results" not in shard:
+            batch = _wait_for_batch(shard["batch_id"], poll_interval)
+            shard["results"] = []
+            for kind, file_id in (("output", batch.output_file_id), ("errors", batch.error_file_id)):
+                if file_id:
+                    directory, name = os.path.split(shard["input"])
+                    path = os.path.join(directory, name.replace("input-", f"{kind}-", 1))
+                    _download_file(file_id, path)
+                    shard["results"].append(path)
+            _save_manifest(batch_dir, manifest)
+        result_paths += shard["results"]
+
+    out_path = os.path.join(batch_dir, "results.jsonl")
+    counts, usage = join_batch_results(manifest["positions"], result_paths, out_path, **manifest["request_options"])
+    print("\n=== Batch Complete ===")
+    print(f"Positions: {sum(counts.values())}")
+    print(f"Legal: {counts['legal']}, Illegal: {counts['illegal']}, Failed: {counts['failed']}, "
+          f"Missing: {counts['missing']}, Invalid FEN: {counts['invalid_fen']}")
+    print(f"Tokens: {usage['prompt_tokens']} prompt, {usage['completion_tokens']} completion")
+    print(f"Results: {out_path}")
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Play GPT (Black) against Stockfish (White).")
+    parser.add_argument("--games", type=int, default=1, help="number of games to simulate")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes; each runs its own Stockfish and OpenAI client")
+    parser.add_argument("--concurrency", type=int, default=0,
+                        help="run games on one asyncio event loop, at most this many at a time")
+    parser.add_argument("--engines", type=int, default=0,
+                        help="size of the Stockfish pool shared by concurrent games (default: one per game)")
+    parser.add_argument("--lease-per-move", action="store_true",
+                        help="lease a pooled engine for each search instead of for the whole game")
+    parser.add_argument("--eval-depth", type=int, default=None,
+                        help="evaluate each GPT move with a separate fixed-depth analysis "
+                             "instead of reusing the score from White's search")
+    parser.add_argument("--ponder", action="store_true",
+                        help="let Stockfish ponder on its expected reply while GPT is thinking")
+    parser.add_argument("--coalesce", action="store_true",
+                        help="share one LLM call between concurrent games asking the same question (with --concurrency)")
+    parser.add_argument("--batch-window", type=float, default=0.0,
+                        help="seconds to hold new LLM requests so near-simultaneous ones can be coalesced")
+    parser.add_argument("--adaptive-llm-concurrency", type=int, default=0, metavar="MAX",
+                        help="adjust in-flight OpenAI calls (up to MAX) from rate-limit headers, 429s and latency")
+    parser.add_argument("--model", default="gpt-4o", help="OpenAI model playing Black")
+    parser.add_argument("--seed", type=int, default=None, help="sampling seed sent with every LLM request")
+    parser.add_argument("--white-time", type=float, default=None,
+                        help=f"Stockfish seconds per move (default {WHITE_LIMIT.time})")
+    parser.add_argument("--jobs-db", metavar="PATH",
+                        help="SQLite job table on shared storage for distributed runs")
+    job_action = parser.add_mutually_exclusive_group()
+    job_action.add_argument("--enqueue", action="store_true", help="queue --games jobs in --jobs-db and exit")
+    job_action.add_argument("--report", action="store_true", help="summarise finished jobs in --jobs-db and exit")
+    parser.add_argument("--openings", metavar="FILE",
+                        help="openings for queued jobs, one line of space-separated UCI moves each")
+    parser.add_argument("--lease-timeout", type=float, default=120.0,
+                        help="seconds without a heartbeat before a running job is requeued")
+    parser.add_argument("--job-attempts", type=int, default=3,
+                        help="times a job abandoned for infrastructure reasons is played before it counts as done")
+    parser.add_argument("--journal", metavar="PATH",
+                        help="append every finished game to this JSON-lines journal")
+    parser.add_argument("--journal-moves", action="store_true", help="also journal every move")
+    parser.add_argument("--resume", action="store_true",
+                        help="rebuild the tally from --journal and play only the missing games")
+    parser.add_argument("--cache", metavar="PATH", help="SQLite cache of LLM answers, shared across runs")
+    parser.add_argument("--cache-max-entries", type=int, default=100000,
+                        help="evict least recently used answers beyond this many")
+    parser.add_argument("--cache-ttl", type=float, default=None, help="seconds before a cached answer expires")
+    parser.add_argument("--cache-bypass", action="store_true",
+                        help="always call the API (answers still refresh the cache), e.g. to measure variance")
+    parser.add_argument("--batch", metavar="POSITIONS",
+                        help="ask for a move in every FEN of POSITIONS through the Batch API, then exit")
+    parser.add_argument("--batch-dir", metavar="DIR",
+                        help="batch input, output and manifest files (default: POSITIONS.batch)")
+    parser.add_argument("--batch-max-requests", type=int, default=BATCH_MAX_REQUESTS,
+                        help="requests per submitted batch")
+    parser.add_argument("--batch-poll-interval", type=float, default=30.0,
+                        help="seconds between batch status checks")
+    parser.add_argument("--base-url", default=os.getenv("OPENAI_BASE_URL"),
+                        help="OpenAI-compatible endpoint, e.g. http://127.0.0.1:8000/v1 for openai_standin.py")
+    parser.add_argument("--provider", choices=sorted(MOVE_PROVIDERS), default="openai",
+                        help="what plays Black: OpenAI chat, an OpenAI-compatible local server (with --base-url), "
+                             "a UCI engine or random legal moves")
+    parser.add_argument("--provider-option", action="append", metavar="KEY=VALUE",
+                        help="provider setting, e.g. skill_level=5 or time=0.1 for uci, seed=1 for random")
+    parser.add_argument("--response-format", choices=["text", "json_schema"], default="text",
+                        help="json_schema: structured output restricted to the legal moves (always a legal answer)")
+    parser.add_argument("--move-retries", type=int, default=0,
+                        help="ask again, saying why, up to this many times when GPT's move is rejected")
+    parser.add_argument("--list-legal-moves", action="store_true",
+                        help="include the legal moves when asking again after a rejected move")
+    parser.add_argument("--prompt-layout", choices=("inline", "prefix"), default="inline",
+                        help="prefix: a long fixed system prompt followed by the position, so the provider "
+                             "can reuse its cached prompt prefix")
+    parser.add_argument("--conversation", choices=("window", "summary"),
+                        help="play each game as one chat that only adds the opponent's latest move, cut to "
+                             "--context-budget by dropping old turns (window) or restarting from the current "
+                             "position (summary); replaces --prompt-layout")
+    parser.add_argument("--context-budget", type=int, default=2048, metavar="TOKENS",
+                        help="estimated prompt tokens a --conversation may grow to")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream answers and stop reading once they contain a legal move (UCI or SAN)")
+    parser.add_argument("--hedge", action="store_true",
+                        help="send a duplicate API request when an answer is slow; the first to succeed wins")
+    parser.add_argument("--hedge-delay", type=float, default=None, metavar="SECONDS",
+                        help="fixed delay before hedging (default: rolling --hedge-percentile of latencies)")
+    parser.add_argument("--hedge-percentile", type=float, default=0.9,
+                        help="latency percentile after which a request is hedged")
+    parser.add_argument("--vote", type=int, default=1, metavar="K",
+                        help="sample K answers per move and play the legal move most of them agree on")
+    parser.add_argument("--vote-mode", choices=["n", "parallel"], default="n",
+                        help="one request with n=K, or K concurrent requests (servers without n)")
+    parser.add_argument("--vote-temperature", type=float, default=0.7,
+                        help="sampling temperature of voted answers")
+    parser.add_argument("--max-retries", type=int, default=5,
+                        help="retries per move for timeouts, 5xx and 429s (with exponential backoff and jitter)")
+    parser.add_argument("--breaker-threshold", type=int, default=5,
+                        help="consecutive API outage errors that pause all games")
+    parser.add_argument("--breaker-timeout", type=float, default=10.0,
+                        help="seconds games pause before the API is tried again")
+    parser.add_argument("--telemetry-interval", type=float, default=0.0, metavar="SECONDS",
+                        help="also print the LLM latency/token telemetry every SECONDS during the run")
+    parser.add_argument("--max-connections", type=int, default=100,
+                        help="HTTP connection pool size per process (kept alive between moves)")
+    parser.add_argument("--keepalive-expiry", type=float, default=60.0,
+                        help="seconds an idle API connection stays open for reuse")
+    parser.add_argument("--http2", action="store_true", help="use HTTP/2 for API calls (needs the h2 package)")
+    parser.add_argument("--request-timeout", type=float, default=60.0, help="seconds per API request")
+    parser.add_argument("--connect-timeout", type=float, default=5.0, help="seconds to open an API connection")
+    parser.add_argument("--prewarm", type=int, default=0, metavar="N",
+                        help="open N API connections per process before the first move")
+    cassette_mode = parser.add_mutually_exclusive_group()
+    cassette_mode.add_argument("--record", metavar="PATH",
+                               help="record every LLM answer and engine result to a cassette file")
+    cassette_mode.add_argument("--replay", metavar="PATH",
+                               help="replay a cassette instead of calling the API and Stockfish")
+    # Everything runs under the finally, so errors after the engine start
+    # also quit Stockfish (its I/O thread would otherwise keep the process
+    # alive).
     try:
-        # For example, simulate 25 games:
-        simulate_games(1)
+        args = parser.parse_args()
+        if args.resume and not args.journal:
+            parser.error("--resume needs --journal")
+        if args.journal and not args.resume and os.path.exists(args.journal) and os.path.getsize(args.journal) > 0:
+            parser.error(f"journal {args.journal} already exists; pass --resume or choose another path")
+        if args.ponder and args.eval_depth is not None:
+            # The separate analysis would interrupt the ponder search every move.
+            parser.error("--ponder cannot be combined with --eval-depth")
+        if args.batch and args.provider not in ("openai", "openai-compatible"):
+            parser.error("--batch needs an OpenAI API provider")
+        if args.batch and args.conversation:
+            parser.error("--batch evaluates single positions; --conversation needs whole games")
+        if args.stream and args.vote > 1:
+            # A vote needs every sample's complete answer.
+            parser.error("--stream cannot be combined with --vote")
+        if args.stream and args.coalesce:
+            # Coalesced games share one complete response, not a stream.
+            parser.error("--stream cannot be combined with --coalesce")
+        try:
+            configure_llm(cache_path=args.cache, cache_max_entries=args.cache_max_entries, cache_ttl=args.cache_ttl,
+                          cache_bypass=args.cache_bypass, base_url=args.base_url, prewarm=args.prewarm,
+                          stream=args.stream, hedge=args.hedge, hedge_delay=args.hedge_delay,
+                          hedge_percentile=args.hedge_percentile, max_retries=args.max_retries,
+                          breaker_threshold=args.breaker_threshold, breaker_timeout=args.breaker_timeout,
+                          http_options=dict(max_connections=args.max_connections,
+                                            keepalive_expiry=args.keepalive_expiry, http2=args.http2,
+                                            timeout=args.request_timeout, connect_timeout=args.connect_timeout),
+                          provider=args.provider, provider_options=parse_provider_options(args.provider_option),
+                          telemetry_interval=args.telemetry_interval, vote=args.vote, vote_mode=args.vote_mode,
+                          vote_temperature=args.vote_temperature)
+        except (ValueError, TypeError) as e:
+            # Unknown or invalid --provider-option values
+            parser.error(f"--provider {args.provider}: {e}")
+        if args.record or args.replay:
+            if args.concurrency > 0:
+                parser.error("cassettes work with the synchronous runners only (no --concurrency)")
+        # Only the serial runner (and a single job worker) plays on the
+        # module-level engine. Pool workers start their own; forking while
+        # its I/O thread runs could deadlock them. --concurrency uses an
+        # EnginePool, and the batch and job table commands need no engine.
+        if (args.workers <= 1 and args.concurrency <= 0 and not (args.batch or args.enqueue or args.report)
+                and not args.replay):
+            start_engine()
+        if args.record or args.replay:
+            configure_cassette("record" if args.record else "replay", args.record or args.replay, truncate=True)
+        game_options = dict(eval_depth=args.eval_depth, ponder=args.ponder, response_format=args.response_format,
+                            move_retries=args.move_retries, list_legal_moves=args.list_legal_moves,
+                            prompt_layout=args.prompt_layout, conversation=args.conversation,
+                            context_budget=args.context_budget)
+        # Settings that distributed jobs carry per game.
+        job_options = dict(model=args.model, seed=args.seed, white_time=args.white_time)
+        journal_options = dict(journal=args.journal, resume=args.resume, journal_moves=args.journal_moves)
+        if args.batch:
+            run_batch(args.batch, batch_dir=args.batch_dir, max_requests=args.batch_max_requests,
+                      poll_interval=args.batch_poll_interval, model=args.model, seed=args.seed,
+                      response_format=args.response_format, prompt_layout=args.prompt_layout)
+        elif args.jobs_db and args.enqueue:
+            enqueue_jobs(args.jobs_db, args.games, model=args.model, white_time=args.white_time,
+                         openings=read_openings(args.openings) if args.openings else None, seed=args.seed or 0)
+        elif args.jobs_db and args.report:
+            report_jobs(args.jobs_db)
+        elif args.jobs_db:
+            run_job_workers(args.jobs_db, workers=args.workers, lease_timeout=args.lease_timeout,
+                            max_attempts=args.job_attempts, **game_options)
+        elif args.concurrency > 0:
+            asyncio.run(async_simulate_games(args.games, max_concurrent=args.concurrency,
+                                             engines=args.engines, lease_per_move=args.lease_per_move,
+                                             coalesce=args.coalesce, batch_window=args.batch_window,
+                                             adaptive_llm_concurrency=args.adaptive_llm_concurrency,
+                                             **journal_options, **game_options, **job_options))
+        else:
+            simulate_games(args.games, workers=args.workers, **journal_options, **game_options, **job_options)
     finally:
-        if engine:
-            engine.quit()
\ No newline at end of file
+        _quit_engine()
+        close_move_provider()
+        if llm_cache:
+            llm_cache.flush()
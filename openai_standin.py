@@ -0,0 +1,623 @@
+import chess
+import chess.engine
+import os
+import re
+import json
+import time
+import random
+import argparse
+import asyncio
+import tempfile
+import io
+from collections import OrderedDict
+
+# Local stand-in for the OpenAI /v1/chat/completions endpoint, for load-testing
+# the harness without spending API money. Point main.py at it with
+#
+#     python openai_standin.py --port 8000 --policy random --latency lognormal:-0.7,0.6
+#     python main.py --base-url http://127.0.0.1:8000/v1 --concurrency 200 --games 1000
+#
+# It is a small asyncio HTTP/1.1 server with keep-alive and no per-request
+# threads, so one process serves thousands of requests per second. Latency is
+# simulated with asyncio.sleep.
+#
+# It also implements enough of the Files and Batches APIs (upload, create,
+# retrieve, download) for main.py --batch: a batch is answered in the
+# background through the same chat completion handler.
+#
+# Prompt prefix caching is simulated the way OpenAI describes it: prompts of
+# 1024 tokens or more are cached in 128-token steps, and cached_tokens is
+# reported in usage.prompt_tokens_details. With --prefill-rate, uncached
+# prompt tokens add to the latency, so cache hits answer sooner.
+
+FEN_RE = re.compile(r"[pnbrqkPNBRQK1-8]+(?:/[pnbrqkPNBRQK1-8]+){7} [wb] (?:[KQkq]+|-) (?:[a-h][36]|-) \d+ \d+")
+
+PLAYED_RE = re.compile(r"played ([a-h][1-8][a-h][1-8][qrbn]?)")
+UCI_RE = re.compile(r"\s*([a-h][1-8][a-h][1-8][qrbn]?)\s*$")
+
+FILLER = ["this", "keeps", "the", "king", "safe", "while", "developing", "pieces", "toward", "centre",
+          "and", "prepares", "castling", "with", "pressure", "on", "diagonal"]
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error"}
+
+BATCH_DONE = ("completed", "failed", "expired", "cancelled")
+
+# Prefix cache steps, in characters at the stand-in's 4 characters per token.
+CACHE_MIN_CHARS = 1024 * 4
+CACHE_STEP_CHARS = 128 * 4
+
+
+def parse_latency(spec: str):
+    # "fixed:0.5", "uniform:0.2,1.5", "exp:0.8" (mean) or "lognormal:mu,sigma"
+    # (seconds are exp(N(mu, sigma))). Returns a function giving one sample.
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",")] if params else []
+    if kind == "fixed":
+        return lambda: values[0] if values else 0.0
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "exp":
+        return lambda: random.expovariate(1.0 / values[0])
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(values[0], values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class TokenBucket:
+    # Refills continuously up to `per_minute`, like OpenAI's RPM/TPM limits.
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount: float) -> bool:
+        self._refill()
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    def reset_after(self, amount: float = 0.0) -> float:
+        # Seconds until `amount` is available (or until full if 0).
+        needed = (amount or self.capacity) - self.tokens
+        return max(0.0, needed / self.rate)
+
+
+def _format_reset(seconds: float) -> str:
+    return f"{int(seconds * 1000)}ms"
+
+
+class StandInServer:
+    def __init__(self, policy: str = "random", latency: str = "fixed:0", error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, rpm: int = 0, tpm: int = 0, illegal_rate: float = 0.0,
+                 script: list = None, engine_path: str = None, engine_depth: int = 8, engines: int = 1,
+                 chatter: int = 0, token_interval: float = 0.0, seed: int = None, batch_dir: str = None,
+                 batch_concurrency: int = 64, prefill_rate: float = 0.0, prefix_cache_size: int = 100000):
+        self.policy = policy
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.illegal_rate = illegal_rate
+        self.chatter = chatter
+        self.token_interval = token_interval
+        self.prefill_rate = prefill_rate
+        self.prefix_cache = OrderedDict()  # hash of a cached prompt prefix -> None, in LRU order
+        self.prefix_cache_size = prefix_cache_size
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.script = script or []
+        self.script_index = 0
+        self.engine_path = engine_path
+        self.engine_depth = engine_depth
+        self.engine_count = engines
+        self.engines = None
+        self.random = random.Random(seed)
+        self.batch_dir = batch_dir or tempfile.mkdtemp(prefix="standin-files-")
+        self.batch_concurrency = batch_concurrency
+        self.files = {}  # file id -> file object (with a private "path")
+        self.batches = {}  # batch id -> batch object
+        self.stats = {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0, "connections": 0, "cache_hits": 0}
+        self.started = time.monotonic()
+
+    async def start_engines(self):
+        if self.policy != "engine":
+            return
+        self.engines = asyncio.Queue()
+        for _ in range(self.engine_count):
+            _, protocol = await chess.engine.popen_uci(self.engine_path)
+            await self.engines.put(protocol)
+
+    # Move policies
+
+    def _illegal_move(self, board: chess.Board) -> str:
+        legal = {move.uci() for move in board.legal_moves}
+        while True:
+            move = chess.Move(self.random.randrange(64), self.random.randrange(64))
+            if move.from_square != move.to_square and move.uci() not in legal:
+                return move.uci()
+
+    async def choose_move(self, board: chess.Board) -> str:
+        legal = sorted(board.legal_moves, key=lambda move: move.uci())
+        if not legal:
+            return "0000"
+        if self.illegal_rate and self.random.random() < self.illegal_rate:
+            return self._illegal_move(board)
+        if self.policy == "random":
+            return self.random.choice(legal).uci()
+        if self.policy == "first":
+            return legal[0].uci()
+        if self.policy == "illegal":
+            return self._illegal_move(board)
+        if self.policy == "script":
+            answer = self.script[self.script_index % len(self.script)]
+            self.script_index += 1
+            return answer
+        if self.policy == "engine":
+            protocol = await self.engines.get()
+            try:
+                result = await protocol.play(board, chess.engine.Limit(depth=self.engine_depth))
+                return result.move.uci()
+            finally:
+                await self.engines.put(protocol)
+        raise ValueError(f"Unknown policy: {self.policy}")
+
+    def _answer(self, move: str) -> str:
+        # With chatter, the move is wrapped in prose and followed by `chatter`
+        # words of explanation, like a chatty or reasoning-style model.
+        if not self.chatter:
+            return move
+        filler = " ".join(self.random.choice(FILLER) for _ in range(self.chatter))
+        return f"Looking at this position, I would play {move}. {filler}."
+
+    # Request handling
+
+    @staticmethod
+    def _prompt_text(body: dict) -> str:
+        parts = []
+        for message in body.get("messages", []):
+            content = message.get("content")
+            if isinstance(content, str):
+                parts.append(content)
+            elif isinstance(content, list):
+                parts.extend(part.get("text", "") for part in content if isinstance(part, dict))
+        return "\n".join(parts)
+
+    @staticmethod
+    def _board(body: dict) -> chess.Board:
+        # The position after the last FEN in the prompt. In a conversation
+        # (main.py --conversation), the moves that follow it are replayed:
+        # "... played e7e5." from the user and bare UCI moves from the
+        # assistant. Rejected answers are not legal moves and are skipped.
+        board = chess.Board()
+        for message in body.get("messages", []):
+            content = message.get("content")
+            if isinstance(content, list):
+                content = "\n".join(part.get("text", "") for part in content if isinstance(part, dict))
+            if not isinstance(content, str):
+                continue
+            fens = FEN_RE.findall(content)
+            if fens:
+                board = chess.Board(fens[-1])
+                continue
+            match = (UCI_RE.match if message.get("role") == "assistant" else PLAYED_RE.search)(content)
+            if match:
+                move = chess.Move.from_uci(match.group(1))
+                if board.is_legal(move):
+                    board.push(move)
+        return board
+
+    @staticmethod
+    def _move_schema(body: dict):
+        # The "move" enum of a json_schema response_format, if there is one.
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") != "json_schema":
+            return None
+        schema = response_format["json_schema"]["schema"]
+        return schema["properties"]["move"]["enum"]
+
+    def _cached_prefix(self, body: dict, text: str) -> int:
+        # Tokens of the longest cached prefix of this prompt, then caches
+        # every step of it. As with OpenAI, the response_format schema comes
+        # before the messages, so a per-request schema defeats the cache.
+        response_format = body.get("response_format")
+        prefix = (json.dumps(response_format, sort_keys=True) + "\n" if response_format else "") + text
+        cached = 0
+        for end in range(CACHE_MIN_CHARS, len(prefix) + 1, CACHE_STEP_CHARS):
+            key = hash((body.get("model"), prefix[:end]))
+            if key in self.prefix_cache:
+                self.prefix_cache.move_to_end(key)
+                cached = end // 4
+            else:
+                self.prefix_cache[key] = None
+        while len(self.prefix_cache) > self.prefix_cache_size:
+            self.prefix_cache.popitem(last=False)
+        return min(cached, max(1, len(text) // 4))
+
+    def _rate_limit_headers(self) -> dict:
+        headers = {}
+        for kind, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+            if bucket:
+                headers[f"x-ratelimit-limit-{kind}"] = str(bucket.capacity)
+                headers[f"x-ratelimit-remaining-{kind}"] = str(int(bucket.tokens))
+                headers[f"x-ratelimit-reset-{kind}"] = _format_reset(bucket.reset_after())
+        return headers
+
+    async def chat_completion(self, body: dict):
+        # Returns (status, headers, payload).
+        self.stats["requests"] += 1
+        text = self._prompt_text(body)
+        prompt_tokens = max(1, len(text) // 4)
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens") or 16
+
+        throttled = self.throttle_rate and self.random.random() < self.throttle_rate
+        if not throttled and self.requests and not self.requests.take(1):
+            throttled = True
+        if not throttled and self.tokens and not self.tokens.take(prompt_tokens + max_tokens):
+            throttled = True
+        if throttled:
+            self.stats["rate_limited"] += 1
+            wait = max(self.requests.reset_after(1) if self.requests else 0.0,
+                       self.tokens.reset_after(prompt_tokens + max_tokens) if self.tokens else 0.0, 0.1)
+            headers = dict(self._rate_limit_headers(), **{"retry-after": f"{wait:.3f}"})
+            return 429, headers, {"error": {"message": "Rate limit reached (stand-in server)", "type": "requests",
+                                            "code": "rate_limit_exceeded"}}
+
+        cached_tokens = self._cached_prefix(body, text)
+        self.stats["cache_hits"] += cached_tokens > 0
+        prefill = (prompt_tokens - cached_tokens) / self.prefill_rate if self.prefill_rate else 0.0
+        await asyncio.sleep(self.latency() + prefill)
+
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return 500, {}, {"error": {"message": "Stand-in server error", "type": "server_error"}}
+
+        board = self._board(body)
+        schema = self._move_schema(body)
+        choices = []
+        for index in range(body.get("n") or 1):
+            move = await self.choose_move(board)
+            if schema is not None:
+                # Constrained decoding can only produce a value the schema allows.
+                if move not in schema:
+                    move = self.random.choice(schema)
+                answer = json.dumps({"move": move})
+            else:
+                answer = self._answer(move)
+            choices.append({"index": index, "message": {"role": "assistant", "content": answer},
+                            "finish_reason": "stop", "logprobs": None})
+        completion_tokens = sum(max(1, len(choice["message"]["content"]) // 4) for choice in choices)
+        self.stats["ok"] += 1
+        return 200, self._rate_limit_headers(), {
+            "id": f"chatcmpl-standin-{self.stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "standin"),
+            "choices": choices,
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens,
+                      "prompt_tokens_details": {"cached_tokens": cached_tokens}},
+        }
+
+    # Files and Batches
+
+    def _new_file(self, filename: str, purpose: str) -> dict:
+        file_id = f"file-standin-{len(self.files) + 1}"
+        self.files[file_id] = {"id": file_id, "object": "file", "bytes": 0, "created_at": int(time.time()),
+                               "filename": filename, "purpose": purpose, "status": "processed",
+                               "path": os.path.join(self.batch_dir, f"{file_id}.jsonl")}
+        return self.files[file_id]
+
+    @staticmethod
+    def _public(file: dict) -> dict:
+        return {key: value for key, value in file.items() if key != "path"}
+
+    async def upload_file(self, reader: asyncio.StreamReader, headers: dict):
+        # POST /files as multipart/form-data. The body is spooled to disk and
+        # split line by line, so an upload of any size never sits in memory.
+        boundary = re.search(r'boundary="?([^";]+)"?', headers.get("content-type", ""))
+        if not boundary:
+            return 400, {}, {"error": {"message": "expected multipart/form-data", "type": "invalid_request_error"}}
+        delimiter = b"--" + boundary.group(1).encode("latin-1")
+        remaining = int(headers.get("content-length", 0))
+        with tempfile.TemporaryFile(dir=self.batch_dir) as spool:
+            while remaining:
+                data = await reader.read(min(remaining, 1 << 16))
+                if not data:
+                    raise ConnectionError("upload cut short")
+                spool.write(data)
+                remaining -= len(data)
+            spool.seek(0)
+            fields, file = {}, None
+            part, sink, pending = None, None, None
+            for line in spool:
+                if line.startswith(delimiter):
+                    # The line break before a delimiter belongs to the delimiter.
+                    if sink is not None:
+                        if pending is not None:
+                            sink.write(pending[:-2] if pending.endswith(b"\r\n") else pending)
+                        if "filename" in part:
+                            sink.close()
+                            file["bytes"] = os.path.getsize(file["path"])
+                        else:
+                            fields[part.get("name", "")] = sink.getvalue().decode()
+                    part, sink, pending = {}, None, None
+                elif part is not None and sink is None:
+                    if line in (b"\r\n", b"\n"):
+                        if "filename" in part:
+                            file = self._new_file(part["filename"], "")
+                            sink = open(file["path"], "wb")
+                        else:
+                            sink = io.BytesIO()
+                    else:
+                        for key, value in re.findall(r'(name|filename)="([^"]*)"', line.decode("latin-1")):
+                            part[key] = value
+                elif sink is not None:
+                    if pending is not None:
+                        sink.write(pending)
+                    pending = line
+        if file is None:
+            return 400, {}, {"error": {"message": "no file part in the upload", "type": "invalid_request_error"}}
+        file["purpose"] = fields.get("purpose", "")
+        return 200, {}, self._public(file)
+
+    async def _write_file(self, writer: asyncio.StreamWriter, file: dict):
+        # GET /files/{id}/content, sent in chunks straight from disk.
+        size = os.path.getsize(file["path"])
+        writer.write(("HTTP/1.1 200 OK\r\ncontent-type: application/octet-stream\r\n"
+                      f"content-length: {size}\r\n\r\n").encode("latin-1"))
+        with open(file["path"], "rb") as f:
+            while data := f.read(1 << 16):
+                writer.write(data)
+                await writer.drain()
+
+    def create_batch(self, body: dict):
+        input_file = self.files.get(body.get("input_file_id"))
+        if input_file is None:
+            return 400, {}, {"error": {"message": f"No such file: {body.get('input_file_id')}",
+                                       "type": "invalid_request_error"}}
+        batch_id = f"batch_standin_{len(self.batches) + 1}"
+        batch = self.batches[batch_id] = {
+            "id": batch_id, "object": "batch", "endpoint": body.get("endpoint", "/v1/chat/completions"),
+            "errors": None, "input_file_id": input_file["id"],
+            "completion_window": body.get("completion_window", "24h"), "status": "validating",
+            "output_file_id": None, "error_file_id": None, "created_at": int(time.time()),
+            "in_progress_at": None, "completed_at": None, "failed_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0}, "metadata": body.get("metadata"),
+        }
+        batch["task"] = asyncio.get_running_loop().create_task(self._run_batch(batch, input_file))
+        return 200, {}, self._public_batch(batch)
+
+    @staticmethod
+    def _public_batch(batch: dict) -> dict:
+        return {key: value for key, value in batch.items() if key != "task"}
+
+    async def _run_batch(self, batch: dict, input_file: dict):
+        # Answers every line of the input file through chat_completion,
+        # batch_concurrency at a time, and writes results in completion order
+        # (like the real API, the output is not in input order).
+        output = self._new_file(f"{batch['id']}_output.jsonl", "batch_output")
+        errors = self._new_file(f"{batch['id']}_error.jsonl", "batch_output")
+        counts = batch["request_counts"]
+        batch["status"], batch["in_progress_at"] = "in_progress", int(time.time())
+        slots = asyncio.Semaphore(self.batch_concurrency)
+        pending = set()
+
+        async def answer(line: bytes, index: int, out, err):
+            try:
+                record = {"id": f"batch_req_{index}", "custom_id": None, "response": None, "error": None}
+                try:
+                    request = json.loads(line)
+                    record["custom_id"] = request["custom_id"]
+                    status, _, payload = await self.chat_completion(request["body"])
+                except (ValueError, KeyError, TypeError) as e:
+                    status, record["error"] = 400, {"code": "invalid_request", "message": str(e)}
+                else:
+                    record["response"] = {"status_code": status, "request_id": f"req_standin_{self.stats['requests']}",
+                                          "body": payload}
+                ok = status == 200
+                (out if ok else err).write(json.dumps(record) + "\n")
+                counts["completed" if ok else "failed"] += 1
+            finally:
+                slots.release()
+
+        with open(input_file["path"], "rb") as lines, open(output["path"], "w") as out, \
+                open(errors["path"], "w") as err:
+            for line in lines:
+                if not line.strip():
+                    continue
+                counts["total"] += 1
+                await slots.acquire()
+                task = asyncio.get_running_loop().create_task(answer(line, counts["total"], out, err))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        for file in (output, errors):
+            file["bytes"] = os.path.getsize(file["path"])
+        batch["output_file_id"] = output["id"] if counts["completed"] else None
+        batch["error_file_id"] = errors["id"] if counts["failed"] else None
+        batch["status"], batch["completed_at"] = "completed", int(time.time())
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stats["connections"] += 1
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                method, path, _ = request_line.split(" ", 2)
+                headers = {}
+                for line in header_lines:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                route = path.split("?", 1)[0].rstrip("/")
+                batch_match = re.search(r"/batches/([^/]+)$", route)
+                content_match = re.search(r"/files/([^/]+)/content$", route)
+                stream_options, download = None, None
+                if method == "POST" and route.endswith("/files"):
+                    status, extra_headers, payload = await self.upload_file(reader, headers)
+                    body = None
+                else:
+                    body = await reader.readexactly(int(headers.get("content-length", 0)))
+                if body is None:
+                    pass  # answered above
+                elif method == "POST" and route.endswith("/chat/completions"):
+                    try:
+                        request = json.loads(body)
+                        status, extra_headers, payload = await self.chat_completion(request)
+                    except (ValueError, KeyError) as e:
+                        status, extra_headers, payload = 400, {}, {"error": {"message": str(e),
+                                                                             "type": "invalid_request_error"}}
+                    else:
+                        if status == 200 and request.get("stream"):
+                            stream_options = request.get("stream_options") or {}
+                elif method == "POST" and route.endswith("/batches"):
+                    try:
+                        status, extra_headers, payload = self.create_batch(json.loads(body))
+                    except ValueError as e:
+                        status, extra_headers, payload = 400, {}, {"error": {"message": str(e),
+                                                                             "type": "invalid_request_error"}}
+                elif method == "GET" and batch_match and batch_match.group(1) in self.batches:
+                    status, extra_headers, payload = 200, {}, self._public_batch(self.batches[batch_match.group(1)])
+                elif method == "GET" and content_match and content_match.group(1) in self.files:
+                    download = self.files[content_match.group(1)]
+                elif method == "GET" and route.endswith("/models"):
+                    status, extra_headers, payload = 200, {}, {"object": "list", "data": [
+                        {"id": "standin", "object": "model", "created": 0, "owned_by": "standin"}]}
+                else:
+                    status, extra_headers, payload = 404, {}, {"error": {"message": f"No route for {method} {path}",
+                                                                         "type": "invalid_request_error"}}
+                if download is not None:
+                    await self._write_file(writer, download)
+                elif stream_options is not None:
+                    await self._write_stream(writer, extra_headers, payload, stream_options)
+                else:
+                    self._write_response(writer, status, extra_headers, payload)
+                    await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except ConnectionError:
+            pass  # the client went away, e.g. it stopped reading a stream early
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _write_response(writer: asyncio.StreamWriter, status: int, headers: dict, payload: dict):
+        data = json.dumps(payload).encode()
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+                 "content-type: application/json",
+                 f"content-length: {len(data)}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + data)
+
+    async def _write_stream(self, writer: asyncio.StreamWriter, headers: dict, completion: dict,
+                            stream_options: dict):
+        # Sends the completion as server-sent events in chunked encoding, a
+        # few characters per chunk and token_interval seconds apart. A client
+        # that stops reading early just closes the connection.
+        lines = ["HTTP/1.1 200 OK", "content-type: text/event-stream", "transfer-encoding: chunked"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+        def event(payload):
+            data = f"data: {payload if isinstance(payload, str) else json.dumps(payload)}\n\n".encode()
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+        def chunk(index: int, delta: dict, finish_reason=None) -> dict:
+            return {"id": completion["id"], "object": "chat.completion.chunk", "created": completion["created"],
+                    "model": completion["model"],
+                    "choices": [{"index": index, "delta": delta, "finish_reason": finish_reason, "logprobs": None}]}
+
+        for choice in completion["choices"]:
+            text = choice["message"]["content"]
+            event(chunk(choice["index"], {"role": "assistant", "content": ""}))
+            for piece in re.findall(r"\S*\s*", text)[:-1] or [text]:
+                event(chunk(choice["index"], {"content": piece}))
+                await writer.drain()
+                if self.token_interval:
+                    await asyncio.sleep(self.token_interval)
+            event(chunk(choice["index"], {}, finish_reason="stop"))
+        if stream_options.get("include_usage"):
+            event(dict(chunk(0, {}), choices=[], usage=completion["usage"]))
+        event("[DONE]")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    def print_stats(self):
+        elapsed = time.monotonic() - self.started
+        print(f"[stand-in] {self.stats['requests']} request(s) in {elapsed:.0f}s "
+              f"({self.stats['requests'] / elapsed:.0f}/s): {self.stats['ok']} ok, "
+              f"{self.stats['rate_limited']} rate limited, {self.stats['errors']} errors, "
+              f"{self.stats['connections']} connection(s), {self.stats['cache_hits']} prompt cache hit(s)")
+
+
+async def serve(server: StandInServer, host: str, port: int, stats_interval: float):
+    await server.start_engines()
+    listener = await asyncio.start_server(server.handle_connection, host, port, backlog=4096)
+    print(f"[stand-in] Serving /v1/chat/completions on http://{host}:{port}/v1 (policy: {server.policy})")
+    print(f"[stand-in] Batch files in {server.batch_dir}")
+    async with listener:
+        while True:
+            await asyncio.sleep(stats_interval)
+            server.print_stats()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stand-in server for chess move requests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--policy", choices=["random", "first", "engine", "illegal", "script"], default="random",
+                        help="how moves are chosen: random legal, first legal, Stockfish, always illegal, "
+                             "or lines from --script")
+    parser.add_argument("--script", metavar="FILE", help="answers to send in order (one per line) for --policy script")
+    parser.add_argument("--latency", default="fixed:0",
+                        help="latency distribution: fixed:S, uniform:A,B, exp:MEAN or lognormal:MU,SIGMA (seconds)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument("--illegal-rate", type=float, default=0.0,
+                        help="fraction of answers replaced by an illegal move")
+    parser.add_argument("--chatter", type=int, default=0, metavar="WORDS",
+                        help="wrap the move in a sentence followed by WORDS words of explanation")
+    parser.add_argument("--token-interval", type=float, default=0.0,
+                        help="seconds between streamed chunks (stream=true requests)")
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute before answering 429 (0: unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="tokens per minute before answering 429 (0: unlimited)")
+    parser.add_argument("--engine-path", default=os.getenv("STOCKFISH_PATH", "stockfish"))
+    parser.add_argument("--engine-depth", type=int, default=8)
+    parser.add_argument("--engines", type=int, default=1, help="Stockfish processes for --policy engine")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--stats-interval", type=float, default=10.0, help="seconds between stats lines")
+    parser.add_argument("--batch-dir", metavar="DIR",
+                        help="where uploaded and batch output files are kept (default: a new temporary directory)")
+    parser.add_argument("--batch-concurrency", type=int, default=64,
+                        help="requests of a batch answered at the same time")
+    parser.add_argument("--prefill-rate", type=float, default=0.0, metavar="TOKENS_PER_SEC",
+                        help="add the time to read the uncached prompt tokens to the latency (0: none)")
+    args = parser.parse_args()
+
+    script = None
+    if args.policy == "script":
+        if not args.script:
+            parser.error("--policy script needs --script FILE")
+        with open(args.script) as f:
+            script = [line.rstrip("\n") for line in f]
+
+    standin = StandInServer(policy=args.policy, latency=args.latency, error_rate=args.error_rate,
+                            throttle_rate=args.throttle_rate, rpm=args.rpm, tpm=args.tpm,
+                            illegal_rate=args.illegal_rate, script=script, engine_path=args.engine_path,
+                            engine_depth=args.engine_depth, engines=args.engines, chatter=args.chatter,
+                            token_interval=args.token_interval, seed=args.seed, batch_dir=args.batch_dir,
+                            batch_concurrency=args.batch_concurrency, prefill_rate=args.prefill_rate)
+    try:
+        asyncio.run(serve(standin, args.host, args.port, args.stats_interval))
+    except KeyboardInterrupt:
+        standin.print_stats()